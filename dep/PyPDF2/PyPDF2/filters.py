@@ -41,6 +41,12 @@ if version_info < ( 3, 0 ):
 else:
     from io import StringIO
     import struct
+    import base64
+    from itertools import accumulate
+
+    _A85_WHITESPACES = b' \n\r\t\x00\x0b\x0c'
+    _A85_DIGITS = bytes(range(33, 118))
+    _A85_VALUES = bytes((c - 33) & 0xff for c in range(256))
 
 try:
     import zlib
@@ -120,7 +126,9 @@ class FlateDecode(object):
         if predictor != 1:
             columns = decodeParms["/Columns"]
             # PNG prediction:
-            if predictor >= 10 and predictor <= 15:
+            if predictor >= 10 and predictor <= 15 and version_info >= ( 3, 0 ):
+                data = _pngUnpredict(data, columns)
+            elif predictor >= 10 and predictor <= 15:
                 output = StringIO()
                 # PNG prediction can vary from row to row
                 rowlength = columns + 1
@@ -154,6 +162,47 @@ class FlateDecode(object):
     encode = staticmethod(encode)
 
 
+if version_info >= ( 3, 0 ):
+    _BYTE_MASK = (255).__and__
+    _SUM_MASKS = {}
+
+    def _addBytes(a, b):
+        # adds two rows bytewise, modulo 256, as one big integer: the low
+        # 7 bits of every byte are added without carrying into the next
+        # byte, and the top bits are then set by xor
+        n = len(a)
+        masks = _SUM_MASKS.get(n)
+        if masks is None:
+            masks = _SUM_MASKS[n] = (int.from_bytes(b'\x7f' * n, 'big'),
+                                     int.from_bytes(b'\x80' * n, 'big'))
+        x = int.from_bytes(a, 'big')
+        y = int.from_bytes(b, 'big')
+        return (((x & masks[0]) + (y & masks[0])) ^ ((x ^ y) & masks[1])).to_bytes(n, 'big')
+
+    def _pngUnpredict(data, columns):
+        # PNG prediction can vary from row to row; every row is decoded
+        # at once instead of byte by byte
+        rowlength = columns + 1
+        assert len(data) % rowlength == 0
+        output = bytearray()
+        prev_rowdata = bytes(columns)
+        for start in range(0, len(data), rowlength):
+            filterByte = data[start]
+            rowdata = data[start + 1:start + rowlength]
+            if filterByte == 0:
+                pass
+            elif filterByte == 1:
+                rowdata = bytes(map(_BYTE_MASK, accumulate(rowdata)))
+            elif filterByte == 2:
+                rowdata = _addBytes(rowdata, prev_rowdata)
+            else:
+                # unsupported PNG filter
+                raise PdfReadError("Unsupported PNG filter %r" % filterByte)
+            prev_rowdata = rowdata
+            output += rowdata
+        return bytes(output)
+
+
 class ASCIIHexDecode(object):
     def decode(data, decodeParms=None):
         retval = ""
@@ -310,6 +359,11 @@ class ASCII85Decode(object):
         else:
             if isinstance(data, str):
                 data = data.encode('ascii')
+            try:
+                return ASCII85Decode._decode(data)
+            except ValueError:
+                # invalid characters are skipped below, as they always were
+                pass
             n = b = 0
             out = bytearray()
             for c in data:
@@ -331,6 +385,52 @@ class ASCII85Decode(object):
             return bytes(out)
     decode = staticmethod(decode)
 
+    if version_info >= ( 3, 0 ):
+        def _decode(data):
+            # Decodes all groups at once.  Digit i of every group is put into
+            # the lowest byte of a 64 bit lane of one big integer; the lanes
+            # are wide enough that multiplying the five integers by the powers
+            # of 85 and adding them never carries from one lane to the next.
+            # Raises ValueError on anything but well-formed data.
+            data = data.strip(_A85_WHITESPACES)
+            if data.startswith(b'<~'):
+                data = data[2:]
+            end = data.find(b'~')
+            if end != -1:
+                data = data[:end]
+            groups = data.translate(None, _A85_WHITESPACES).split(b'z')
+            for group in groups[:-1]:
+                if len(group) % 5:
+                    raise ValueError("'z' inside an ASCII85 group")
+            data = b'!!!!!'.join(groups)
+            if end == -1:
+                # without an end of data marker a partial group is dropped
+                data = data[:len(data) - len(data) % 5]
+            if data.translate(None, _A85_DIGITS):
+                raise ValueError("invalid ASCII85 character")
+            padding = -len(data) % 5
+            digits = (data + b'u' * padding).translate(_A85_VALUES)
+            count = len(digits) // 5
+            total = 0
+            for i in range(5):
+                lanes = bytearray(8 * count)
+                lanes[7::8] = digits[i::5]
+                total = total * 85 + int.from_bytes(lanes, 'big')
+            lanes = total.to_bytes(8 * count, 'big')
+            if lanes[3::8].strip(b'\x00'):
+                raise ValueError("ASCII85 group out of range")
+            out = bytearray(4 * count)
+            for i in range(4):
+                out[i::4] = lanes[4 + i::8]
+            if padding:
+                del out[-padding:]
+            return bytes(out)
+        _decode = staticmethod(_decode)
+
+        def encode(data):
+            return base64.a85encode(data, wrapcol=72) + b'~>'
+        encode = staticmethod(encode)
+
 
 def decodeStreamData(stream):
     from .generic import NameObject
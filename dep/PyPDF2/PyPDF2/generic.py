@@ -35,6 +35,7 @@ __author__ = "Mathieu Fenniak"
 __author_email__ = "biziqe@mathieu.fenniak.net"
 
 import re
+import binascii
 from .utils import readNonWhitespace, RC4_encrypt, skipOverComment
 from .utils import b_, u_, chr_, ord_
 from .utils import PdfStreamError
@@ -50,8 +51,74 @@ ObjectPrefix = b_('/<[tf(n%')
 NumberSigns = b_('+-')
 IndirectPattern = re.compile(b_(r"(\d+)\s+(\d+)\s+R[^a-zA-Z]"))
 
+# Patterns of the buffer based reader.  It scans a bytes-like object with
+# them, instead of reading a stream one or two bytes at a time.
+WhitespacePattern = re.compile(b_(r"[\x00\t\n\x0c\r ]*"))
+EndOfLinePattern = re.compile(b_(r"[^\r\n]*[\r\n]?"))
+NamePattern = re.compile(b_(r"/[^\s()<>\[\]{}/%]*"))
+# the tokens that make up most of a content stream: a number, a name or an
+# operator, after any whitespace
+ContentTokenPattern = re.compile(b_(r"[\x00\t\n\x0c\r ]*(?:([+-.0-9]+)|(/[^\s()<>\[\]{}/%]*)|([A-Za-z'\"][^\s()<>\[\]{}/%]*))?"))
+# a whole operation whose operands are only numbers, names and strings
+# without escapes; the lookaheads make every token end at a delimiter, so
+# the pattern cannot backtrack
+SimpleOperandPattern = re.compile(b_(r"[+-.0-9]+(?![+-.0-9])|/[^\s()<>\[\]{}/%]*(?![^\s()<>\[\]{}/%])"
+                                     r"|\([^()\\]*\)|<[0-9A-Fa-f]*>"))
+SimpleOperationPattern = re.compile(b_(r"((?:[\x00\t\n\x0c\r ]*(?:%s))*)[\x00\t\n\x0c\r ]*([A-Za-z'\"][^\s()<>\[\]{}/%%]*)"
+                                       % SimpleOperandPattern.pattern.decode("latin-1")))
+NumberTokenPattern = re.compile(b_(r"[+-.0-9]*"))
+StringSpecialPattern = re.compile(b_(r"[()\\]"))
+HexStringPattern = re.compile(b_(r"<([^>]*)>"))
+NumberDigitsPattern = re.compile(b_(r"[0-9]+"))
+HexWhitespaces = b_(" \n\r\t\x00")
+# Single bytes as indexing a bytes object gives them: ints on Python 3 and
+# one character strings on Python 2
+NameStart = b_("/")[0]
+HexStringStart = b_("<")[0]
+DictionaryEnd = b_(">")[0]
+ArrayStart = b_("[")[0]
+ArrayEnd = b_("]")[0]
+StringStart = b_("(")[0]
+StringEnd = b_(")")[0]
+CommentStart = b_("%")[0]
+BooleanStarts = b_("tf")
+NullStart = b_("n")[0]
+DecimalDigits = b_("0123456789")
+EndOfLines = b_("\r\n")
+StringEscapes = dict((b_(k)[0], b_(v)) for k, v in (
+    ("n", "\n"), ("r", "\r"), ("t", "\t"), ("b", "\b"), ("f", "\f"), ("c", "\\c"),
+    ("(", "("), (")", ")"), ("/", "/"), ("\\", "\\"),
+    # odd/unnessecary escape sequences we have encountered
+    (" ", " "), ("%", "%"), ("<", "<"), (">", ">"), ("[", "["), ("]", "]"),
+    ("#", "#"), ("_", "_"), ("&", "&"), ("$", "$")))
+
+
+def getStreamBuffer(stream):
+    """
+    Returns a memoryview of the whole stream if it is held in memory, as
+    BytesIO is, otherwise None.  The caller must release it.
+    """
+    getbuffer = getattr(stream, "getbuffer", None)
+    if getbuffer is None:
+        return None
+    return getbuffer()
+
 
 def readObject(stream, pdf):
+    buf = getStreamBuffer(stream)
+    if buf is not None:
+        try:
+            pos = WhitespacePattern.match(buf, stream.tell()).end()
+            isDictionary = buf[pos:pos + 2] == b_("<<")
+            if not isDictionary:
+                obj, pos = readObjectFromBuffer(buf, pos, pdf)
+        finally:
+            buf.release()
+        stream.seek(pos, 0)
+        if isDictionary:
+            # it may be followed by stream data
+            return DictionaryObject.readFromStream(stream, pdf)
+        return obj
     tok = stream.read(1)
     stream.seek(-1, 1) # reset to start
     idx = ObjectPrefix.find(tok)
@@ -98,6 +165,164 @@ def readObject(stream, pdf):
             return NumberObject.readFromStream(stream)
 
 
+def readObjectFromBuffer(data, pos, pdf):
+    """
+    Reads an object from data, a bytes-like object, starting at pos.
+    Returns the object and the position just after it.  Dictionaries are
+    read without any stream data that follows them.
+    """
+    end = len(data)
+    pos = WhitespacePattern.match(data, pos).end()
+    if pos >= end:
+        raise PdfStreamError("Stream has ended unexpectedly")
+    tok = data[pos]
+    if tok == NameStart:
+        # name object
+        m = NamePattern.match(data, pos)
+        return createNameObject(m.group(0), pdf), m.end()
+    elif tok == HexStringStart:
+        # hexadecimal string OR dictionary
+        if data[pos + 1:pos + 2] == b_("<"):
+            dictionary, pos = readDictionaryFromBuffer(data, pos, pdf)
+            retval = DictionaryObject()
+            retval.update(dictionary)
+            return retval, pos
+        return readHexStringFromBuffer(data, pos)
+    elif tok == ArrayStart:
+        # array object
+        arr = ArrayObject()
+        pos += 1
+        while True:
+            pos = WhitespacePattern.match(data, pos).end()
+            if pos >= end:
+                raise PdfStreamError("Stream has ended unexpectedly")
+            if data[pos] == ArrayEnd:
+                return arr, pos + 1
+            obj, pos = readObjectFromBuffer(data, pos, pdf)
+            arr.append(obj)
+    elif tok in BooleanStarts:
+        # boolean object
+        if data[pos:pos + 4] == b_("true"):
+            return BooleanObject(True), pos + 4
+        elif data[pos:pos + 5] == b_("false"):
+            return BooleanObject(False), pos + 5
+        raise utils.PdfReadError('Could not read Boolean object')
+    elif tok == StringStart:
+        # string object
+        return readStringFromBuffer(data, pos)
+    elif tok == NullStart:
+        # null object
+        if data[pos:pos + 4] != b_("null"):
+            raise utils.PdfReadError("Could not read Null object")
+        return NullObject(), pos + 4
+    elif tok == CommentStart:
+        # comment
+        return readObjectFromBuffer(data, EndOfLinePattern.match(data, pos).end(), pdf)
+    else:
+        # number object OR indirect reference
+        if tok not in NumberSigns:
+            m = IndirectPattern.match(data, pos, pos + 20)
+            if m is not None:
+                return IndirectObject(int(m.group(1)), int(m.group(2)), pdf), m.end() - 1
+        m = NumberTokenPattern.match(data, pos)
+        num = m.group(0)
+        if num.find(NumberObject.ByteDot) != -1:
+            return FloatObject(num), m.end()
+        return NumberObject(num), m.end()
+
+
+def readDictionaryFromBuffer(data, pos, pdf):
+    """
+    Reads the entries of the dictionary at pos in data into a dict.  Returns
+    the dict and the position just after the closing ">>".
+    """
+    if data[pos:pos + 2] != b_("<<"):
+        raise utils.PdfReadError("Dictionary read error at byte %s: stream must begin with '<<'" % utils.hexStr(pos))
+    end = len(data)
+    pos += 2
+    entries = {}
+    while True:
+        pos = WhitespacePattern.match(data, pos).end()
+        if pos >= end:
+            # stream has truncated prematurely
+            raise PdfStreamError("Stream has ended unexpectedly")
+        tok = data[pos]
+        if tok == CommentStart:
+            pos = EndOfLinePattern.match(data, pos).end()
+            continue
+        if tok == DictionaryEnd:
+            pos += 2
+            break
+        key, pos = readObjectFromBuffer(data, pos, pdf)
+        value, pos = readObjectFromBuffer(data, pos, pdf)
+        if not entries.get(key):
+            entries[key] = value
+        elif pdf is not None and pdf.strict:
+            # multiple definitions of key not permitted
+            raise utils.PdfReadError("Multiple definitions in dictionary at byte %s for key %s" \
+                                       % (utils.hexStr(pos), key))
+        else:
+            warnings.warn("Multiple definitions in dictionary at byte %s for key %s" \
+                                       % (utils.hexStr(pos), key), utils.PdfReadWarning)
+    return entries, pos
+
+
+def readHexStringFromBuffer(data, pos):
+    m = HexStringPattern.match(data, pos)
+    if m is None:
+        # stream has truncated prematurely
+        raise PdfStreamError("Stream has ended unexpectedly")
+    x = m.group(1).translate(None, HexWhitespaces)
+    if len(x) % 2:
+        x += b_("0")
+    return createStringObject(binascii.unhexlify(x)), m.end()
+
+
+def readStringFromBuffer(data, pos):
+    end = len(data)
+    pos += 1
+    parens = 1
+    parts = []
+    while True:
+        m = StringSpecialPattern.search(data, pos)
+        if m is None:
+            # stream has truncated prematurely
+            raise PdfStreamError("Stream has ended unexpectedly")
+        parts.append(data[pos:m.start()])
+        tok = data[m.start()]
+        pos = m.end()
+        if tok == StringStart:
+            parens += 1
+            parts.append(b_("("))
+        elif tok == StringEnd:
+            parens -= 1
+            if parens == 0:
+                break
+            parts.append(b_(")"))
+        else:
+            if pos >= end:
+                raise PdfStreamError("Stream has ended unexpectedly")
+            tok = data[pos]
+            pos += 1
+            if tok in StringEscapes:
+                parts.append(StringEscapes[tok])
+            elif tok in DecimalDigits:
+                # "The number ddd may consist of one, two, or three
+                # octal digits; high-order overflow shall be ignored."
+                # (PDF reference 7.3.4.2, p 16)
+                digits = NumberDigitsPattern.match(data, pos - 1, pos + 2).group(0)
+                pos += len(digits) - 1
+                parts.append(bytes(bytearray([int(digits, base=8) & 0xff])))
+            elif tok in EndOfLines:
+                # an escaped line break adds nothing to the string; a
+                # multi-char EOL is consumed as a whole
+                if pos < end and data[pos] in EndOfLines:
+                    pos += 1
+            else:
+                raise utils.PdfReadError(r"Unexpected escaped string: %s" % chr_(tok))
+    return createStringObject(b_("").join(parts)), pos
+
+
 class PdfObject(object):
     def getObject(self):
         """Resolves indirect references."""
@@ -223,7 +448,46 @@ class IndirectObject(PdfObject):
     readFromStream = staticmethod(readFromStream)
 
 
-class FloatObject(decimal.Decimal, PdfObject):
+class FloatObject(float, PdfObject):
+    """
+    A real number, backed by a float.  It is written with the shortest
+    digits that read back as the same float, never in exponent notation.
+
+    Set ``FloatObject.strict`` to True to get exact
+    :class:`DecimalObject<DecimalObject>` instances instead, as PyPDF2
+    used to create; it is much slower.
+    """
+    strict = False
+
+    def __new__(cls, value="0", context=None):
+        if FloatObject.strict:
+            return DecimalObject(value, context)
+        try:
+            return float.__new__(cls, value)
+        except (TypeError, ValueError):
+            return float.__new__(cls, utils.str_(value))
+
+    def __repr__(self):
+        if self.is_integer():
+            return "%d" % self
+        o = float.__repr__(self)
+        if "e" in o:
+            # PDF has no exponent notation
+            o = format(decimal.Decimal(o), "f")
+        return o
+
+    def as_numeric(self):
+        return float(self)
+
+    def writeToStream(self, stream, encryption_key):
+        stream.write(b_(repr(self)))
+
+
+class DecimalObject(decimal.Decimal, PdfObject):
+    """
+    A real number, backed by a Decimal.  Created by
+    :class:`FloatObject<FloatObject>` in its strict mode.
+    """
     def __new__(cls, value="0", context=None):
         try:
             return decimal.Decimal.__new__(cls, utils.str_(value), context)
@@ -480,20 +744,24 @@ class NameObject(str, PdfObject):
         name += utils.readUntilRegex(stream, NameObject.delimiterPattern, 
             ignore_eof=True)
         if debug: print(name)
-        try:
-            return NameObject(name.decode('utf-8'))
-        except (UnicodeEncodeError, UnicodeDecodeError) as e:
-            # Name objects should represent irregular characters
-            # with a '#' followed by the symbol's hex number
-            if not pdf.strict:
-                warnings.warn("Illegal character in Name Object", utils.PdfReadWarning)
-                return NameObject(name)
-            else:
-                raise utils.PdfReadError("Illegal character in Name Object")
+        return createNameObject(name, pdf)
 
     readFromStream = staticmethod(readFromStream)
 
 
+def createNameObject(name, pdf):
+    try:
+        return NameObject(name.decode('utf-8'))
+    except (UnicodeEncodeError, UnicodeDecodeError) as e:
+        # Name objects should represent irregular characters
+        # with a '#' followed by the symbol's hex number
+        if pdf is None or not pdf.strict:
+            warnings.warn("Illegal character in Name Object", utils.PdfReadWarning)
+            return NameObject(name)
+        else:
+            raise utils.PdfReadError("Illegal character in Name Object")
+
+
 class DictionaryObject(dict, PdfObject):
     def raw_get(self, key):
         return dict.__getitem__(self, key)
@@ -550,8 +818,7 @@ class DictionaryObject(dict, PdfObject):
             stream.write(b_("\n"))
         stream.write(b_(">>"))
 
-    def readFromStream(stream, pdf):
-        debug = False
+    def _readEntriesFromStream(stream, pdf):
         tmp = stream.read(2)
         if tmp != b_("<<"):
             raise utils.PdfReadError("Dictionary read error at byte %s: stream must begin with '<<'" % utils.hexStr(stream.tell()))
@@ -568,7 +835,6 @@ class DictionaryObject(dict, PdfObject):
                 # stream has truncated prematurely
                 raise PdfStreamError("Stream has ended unexpectedly")
 
-            if debug: print(("Tok:", tok))
             if tok == b_(">"):
                 stream.read(1)
                 break
@@ -587,6 +853,21 @@ class DictionaryObject(dict, PdfObject):
                 warnings.warn("Multiple definitions in dictionary at byte %s for key %s" \
                                            % (utils.hexStr(stream.tell()), key), utils.PdfReadWarning)
 
+        return data
+    _readEntriesFromStream = staticmethod(_readEntriesFromStream)
+
+    def readFromStream(stream, pdf):
+        debug = False
+        buf = getStreamBuffer(stream)
+        if buf is not None:
+            try:
+                data, pos = readDictionaryFromBuffer(buf, stream.tell(), pdf)
+            finally:
+                buf.release()
+            stream.seek(pos, 0)
+        else:
+            data = DictionaryObject._readEntriesFromStream(stream, pdf)
+
         pos = stream.tell()
         s = readNonWhitespace(stream)
         if s == b_('s') and stream.read(5) == b_('tream'):
@@ -866,7 +1147,7 @@ class RectangleObject(ArrayObject):
         ArrayObject.__init__(self, [self.ensureIsNumber(x) for x in arr])
 
     def ensureIsNumber(self, value):
-        if not isinstance(value, (NumberObject, FloatObject)):
+        if not isinstance(value, (NumberObject, FloatObject, DecimalObject)):
             value = FloatObject(value)
         return value
 
@@ -47,6 +47,7 @@ import math
 import struct
 import sys
 import uuid
+import binascii
 from sys import version_info
 if version_info < ( 3, 0 ):
     from cStringIO import StringIO
@@ -75,14 +76,24 @@ else:
     from hashlib import md5
 import uuid
 
+# objects packed into one object stream by PdfFileWriter(useObjectStreams=True)
+_OBJECT_STREAM_SIZE = 100
+
 
 class PdfFileWriter(object):
     """
     This class supports writing PDF files out, given pages produced by another
     class (typically :class:`PdfFileReader<PdfFileReader>`).
+
+    :param bool useObjectStreams: Write a PDF 1.5 file, in which all objects
+        but streams are packed into compressed object streams and the
+        cross-reference table is a compressed cross-reference stream.
+        Encrypted files are always written the classic way.
+        Defaults to ``False``.
     """
-    def __init__(self):
+    def __init__(self, useObjectStreams=False):
         self._header = b_("%PDF-1.3")
+        self._useObjectStreams = useObjectStreams
         self._objects = []  # array of indirect objects
 
         # The root of our page tree node.
@@ -482,6 +493,10 @@ class PdfFileWriter(object):
         self._sweepIndirectReferences(externalReferenceMap, self._root)
         del self.stack
 
+        if self._useObjectStreams and not hasattr(self, "_encrypt"):
+            self._writeWithObjectStreams(stream)
+            return
+
         # Begin writing:
         object_positions = []
         stream.write(self._header + b_("\n"))
@@ -512,8 +527,15 @@ class PdfFileWriter(object):
         # trailer
         stream.write(b_("trailer\n"))
         trailer = DictionaryObject()
+        self._updateTrailer(trailer, len(self._objects) + 1)
+        trailer.writeToStream(stream, None)
+
+        # eof
+        stream.write(b_("\nstartxref\n%s\n%%%%EOF\n" % (xref_location)))
+
+    def _updateTrailer(self, trailer, size):
         trailer.update({
-                NameObject("/Size"): NumberObject(len(self._objects) + 1),
+                NameObject("/Size"): NumberObject(size),
                 NameObject("/Root"): self._root,
                 NameObject("/Info"): self._info,
                 })
@@ -521,10 +543,81 @@ class PdfFileWriter(object):
             trailer[NameObject("/ID")] = self._ID
         if hasattr(self, "_encrypt"):
             trailer[NameObject("/Encrypt")] = self._encrypt
-        trailer.writeToStream(stream, None)
+
+    def _writeWithObjectStreams(self, stream):
+        # PDF 1.5 layout: streams stay top-level objects, everything else
+        # goes into object streams of at most _OBJECT_STREAM_SIZE objects,
+        # and a cross-reference stream replaces the xref table and trailer.
+        header = self._header
+        if header < b_("%PDF-1.5"):
+            header = b_("%PDF-1.5")
+        stream.write(header + b_("\n"))
+
+        # (type, field 2, field 3) of every xref stream entry, see PDF spec
+        # table 18; object 0 is the head of the free list
+        entries = [(0, 0, 65535)]
+        packed = []
+        for i in range(len(self._objects)):
+            idnum = (i + 1)
+            obj = self._objects[i]
+            if isinstance(obj, StreamObject):
+                entries.append((1, stream.tell(), 0))
+                stream.write(b_(str(idnum) + " 0 obj\n"))
+                obj.writeToStream(stream, None)
+                stream.write(b_("\nendobj\n"))
+            else:
+                entries.append(None)
+                packed.append(idnum)
+
+        for start in range(0, len(packed), _OBJECT_STREAM_SIZE):
+            objStmNum = len(entries)
+            objectNums = packed[start:start + _OBJECT_STREAM_SIZE]
+            offsets = []
+            data = BytesIO()
+            for index, idnum in enumerate(objectNums):
+                entries[idnum] = (2, objStmNum, index)
+                offsets.append("%d %d" % (idnum, data.tell()))
+                self._objects[idnum - 1].writeToStream(data, None)
+                data.write(b_("\n"))
+            offsets = b_(" ".join(offsets) + "\n")
+            objStm = EncodedStreamObject()
+            objStm.update({
+                NameObject("/Type"): NameObject("/ObjStm"),
+                NameObject("/N"): NumberObject(len(objectNums)),
+                NameObject("/First"): NumberObject(len(offsets)),
+                NameObject("/Filter"): NameObject("/FlateDecode"),
+                })
+            objStm._data = filters.FlateDecode.encode(offsets + data.getvalue())
+            entries.append((1, stream.tell(), 0))
+            stream.write(b_(str(objStmNum) + " 0 obj\n"))
+            objStm.writeToStream(stream, None)
+            stream.write(b_("\nendobj\n"))
+
+        # the xref stream lists itself as well
+        xrefNum = len(entries)
+        xref_location = stream.tell()
+        entries.append((1, xref_location, 0))
+        widths = [1, 1, 1]
+        for entry in entries:
+            for i in (1, 2):
+                while entry[i] >> (8 * widths[i]):
+                    widths[i] += 1
+        rowFormat = "%%02x%%0%dx%%0%dx" % (2 * widths[1], 2 * widths[2])
+        xrefStm = EncodedStreamObject()
+        self._updateTrailer(xrefStm, len(entries))
+        xrefStm.update({
+            NameObject("/Type"): NameObject("/XRef"),
+            NameObject("/W"): ArrayObject([NumberObject(w) for w in widths]),
+            NameObject("/Filter"): NameObject("/FlateDecode"),
+            })
+        xrefStm._data = filters.FlateDecode.encode(
+            binascii.unhexlify("".join([rowFormat % entry for entry in entries])))
+        stream.write(b_(str(xrefNum) + " 0 obj\n"))
+        xrefStm.writeToStream(stream, None)
+        stream.write(b_("\nendobj\n"))
 
         # eof
-        stream.write(b_("\nstartxref\n%s\n%%%%EOF\n" % (xref_location)))
+        stream.write(b_("startxref\n%s\n%%%%EOF\n" % (xref_location)))
 
     def addMetadata(self, infos):
         """
@@ -2213,6 +2306,40 @@ class PageObject(DictionaryObject):
         return contents
     _addTransformationMatrix = staticmethod(_addTransformationMatrix)
 
+    def _pushPopGSStreams(streams):
+        # like _pushPopGS, but the content streams are neither decoded nor
+        # parsed: they are referenced as they are, between a small "q"
+        # stream and a small "Q" stream.  The line breaks keep the operators
+        # apart from the tokens of the streams next to them.
+        push = DecodedStreamObject()
+        push.setData(b_("q\n"))
+        pop = DecodedStreamObject()
+        pop.setData(b_("\nQ\n"))
+        return [push] + list(streams) + [pop]
+    _pushPopGSStreams = staticmethod(_pushPopGSStreams)
+
+    def _transformationMatrixStream(ctm):
+        # a content stream holding only the "cm" operator of ctm
+        data = BytesIO()
+        for x in ctm:
+            FloatObject(x).writeToStream(data, None)
+            data.write(b_(" "))
+        data.write(b_("cm\n"))
+        stream = DecodedStreamObject()
+        stream.setData(data.getvalue())
+        return stream
+    _transformationMatrixStream = staticmethod(_transformationMatrixStream)
+
+    def _getContentStreams(self):
+        # the content streams of the page, as indirect references where
+        # possible, without reading their data
+        contents = self.getContents()
+        if contents is None:
+            return []
+        if isinstance(contents, ArrayObject):
+            return list(contents)
+        return [self.raw_get("/Contents")]
+
     def getContents(self):
         """
         Accesses the page contents.
@@ -2269,21 +2396,27 @@ class PageObject(DictionaryObject):
             )
         )
 
+        # The content streams are wrapped in q/Q by reference.  page2's
+        # streams are only parsed when a transformation function is given or
+        # some of its resource names have to be changed.
         newContentArray = ArrayObject()
 
-        originalContent = self.getContents()
-        if originalContent is not None:
-            newContentArray.append(PageObject._pushPopGS(
-                  originalContent, self.pdf))
+        originalStreams = self._getContentStreams()
+        if originalStreams:
+            newContentArray.extend(PageObject._pushPopGSStreams(originalStreams))
 
         page2Content = page2.getContents()
         if page2Content is not None:
-            if page2transformation is not None:
-                page2Content = page2transformation(page2Content)
-            page2Content = PageObject._contentStreamRename(
-                page2Content, rename, self.pdf)
-            page2Content = PageObject._pushPopGS(page2Content, self.pdf)
-            newContentArray.append(page2Content)
+            if page2transformation is not None or rename:
+                if page2transformation is not None:
+                    page2Content = page2transformation(page2Content)
+                page2Streams = [PageObject._contentStreamRename(
+                    page2Content, rename, self.pdf)]
+            else:
+                page2Streams = page2._getContentStreams()
+            if ctm is not None and page2transformation is None:
+                page2Streams.insert(0, PageObject._transformationMatrixStream(ctm))
+            newContentArray.extend(PageObject._pushPopGSStreams(page2Streams))
 
         # if expanding the page to fit a new page, calculate the new media box size
         if expand:
@@ -2308,7 +2441,7 @@ class PageObject(DictionaryObject):
             self.mediaBox.setLowerLeft(lowerleft)
             self.mediaBox.setUpperRight(upperright)
 
-        self[NameObject('/Contents')] = ContentStream(newContentArray, self.pdf)
+        self[NameObject('/Contents')] = newContentArray
         self[NameObject('/Resources')] = newResources
         self[NameObject('/Annots')] = newAnnots
 
@@ -2324,8 +2457,7 @@ class PageObject(DictionaryObject):
         :param bool expand: Whether the page should be expanded to fit the dimensions
             of the page to be merged.
         """
-        self._mergePage(page2, lambda page2Content:
-            PageObject._addTransformationMatrix(page2Content, page2.pdf, ctm), ctm, expand)
+        self._mergePage(page2, ctm=ctm, expand=expand)
 
     def mergeScaledPage(self, page2, scale, expand=False):
         """
@@ -2502,12 +2634,11 @@ class PageObject(DictionaryObject):
         :param tuple ctm: A 6-element tuple containing the operands of the
             transformation matrix.
         """
-        originalContent = self.getContents()
-        if originalContent is not None:
-            newContent = PageObject._addTransformationMatrix(
-                originalContent, self.pdf, ctm)
-            newContent = PageObject._pushPopGS(newContent, self.pdf)
-            self[NameObject('/Contents')] = newContent
+        originalStreams = self._getContentStreams()
+        if originalStreams:
+            originalStreams.insert(0, PageObject._transformationMatrixStream(ctm))
+            self[NameObject('/Contents')] = ArrayObject(
+                PageObject._pushPopGSStreams(originalStreams))
 
     def scale(self, sx, sy):
         """
@@ -2657,6 +2788,10 @@ class PageObject(DictionaryObject):
     """
 
 
+# the "R" that ends an indirect reference, as indexing bytes gives it
+ReferenceOperator = b_("R")[0]
+
+
 class ContentStream(DecodedStreamObject):
     def __init__(self, stream, pdf):
         self.pdf = pdf
@@ -2665,45 +2800,96 @@ class ContentStream(DecodedStreamObject):
         # multiple StreamObjects to be cat'd together.
         stream = stream.getObject()
         if isinstance(stream, ArrayObject):
-            data = b_("")
-            for s in stream:
-                data += s.getObject().getData()
-            stream = BytesIO(b_(data))
+            data = b_("").join(s.getObject().getData() for s in stream)
         else:
-            stream = BytesIO(b_(stream.getData()))
-        self.__parseContentStream(stream)
+            data = b_(stream.getData())
+        self.__parseContentStream(data)
 
-    def __parseContentStream(self, stream):
-        # file("f:\\tmp.txt", "w").write(stream.read())
-        stream.seek(0, 0)
+    def __parseContentStream(self, data):
+        # The data is scanned in place with compiled patterns; only inline
+        # images are read through a stream.
+        operations = self.operations
         operands = []
+        pos = 0
+        end = len(data)
+        readOperation = SimpleOperationPattern.match
+        findOperands = SimpleOperandPattern.findall
+        readToken = ContentTokenPattern.match
+        inlineImage = b_("BI")
+        objects = {}
         while True:
-            peek = readNonWhitespace(stream)
-            if peek == b_('') or ord_(peek) == 0:
-                break
-            stream.seek(-1, 1)
-            if peek.isalpha() or peek == b_("'") or peek == b_('"'):
-                operator = utils.readUntilRegex(stream,
-                        NameObject.delimiterPattern, True)
-                if operator == b_("BI"):
+            m = readOperation(data, pos)
+            # "R" may end an indirect reference, which is left to readObject
+            if m is not None and m.group(2) != inlineImage and m.group(2)[0] != ReferenceOperator:
+                for operand in findOperands(m.group(1)):
+                    # these objects are immutable, so equal tokens share one
+                    obj = objects.get(operand)
+                    if obj is None:
+                        tok = operand[0]
+                        if tok == NameStart:
+                            obj = createNameObject(operand, None)
+                        elif tok == StringStart:
+                            obj = createStringObject(operand[1:-1])
+                        elif tok == HexStringStart:
+                            obj = readHexStringFromBuffer(operand, 0)[0]
+                        elif operand.find(NumberObject.ByteDot) != -1:
+                            obj = FloatObject(operand)
+                        else:
+                            obj = NumberObject(operand)
+                        objects[operand] = obj
+                    operands.append(obj)
+                operations.append((operands, m.group(2)))
+                operands = []
+                pos = m.end()
+                continue
+            # anything else is read one token at a time
+            m = readToken(data, pos)
+            kind = m.lastindex
+            if kind == 1:
+                num = m.group(1)
+                if num.find(NumberObject.ByteDot) != -1:
+                    operands.append(FloatObject(num))
+                    pos = m.end()
+                elif (num[0] in NumberSigns
+                        or IndirectPattern.match(data, m.start(1), m.start(1) + 20) is None):
+                    operands.append(NumberObject(num))
+                    pos = m.end()
+                else:
+                    # an indirect reference
+                    operand, pos = readObjectFromBuffer(data, m.start(1), None)
+                    operands.append(operand)
+            elif kind == 2:
+                operands.append(createNameObject(m.group(2), None))
+                pos = m.end()
+            elif kind == 3:
+                operator = m.group(3)
+                pos = m.end()
+                if operator == inlineImage:
                     # begin inline image - a completely different parsing
                     # mechanism is required, of course... thanks buddy...
                     assert operands == []
+                    stream = BytesIO(data)
+                    stream.seek(pos, 0)
                     ii = self._readInlineImage(stream)
-                    self.operations.append((ii, b_("INLINE IMAGE")))
+                    pos = stream.tell()
+                    operations.append((ii, b_("INLINE IMAGE")))
                 else:
-                    self.operations.append((operands, operator))
+                    operations.append((operands, operator))
                     operands = []
-            elif peek == b_('%'):
-                # If we encounter a comment in the content stream, we have to
-                # handle it here.  Typically, readObject will handle
-                # encountering a comment -- but readObject assumes that
-                # following the comment must be the object we're trying to
-                # read.  In this case, it could be an operator instead.
-                while peek not in (b_('\r'), b_('\n')):
-                    peek = stream.read(1)
             else:
-                operands.append(readObject(stream, None))
+                pos = m.end()
+                if pos >= end:
+                    break
+                if data[pos] == CommentStart:
+                    # If we encounter a comment in the content stream, we have to
+                    # handle it here.  Typically, readObject will handle
+                    # encountering a comment -- but readObject assumes that
+                    # following the comment must be the object we're trying to
+                    # read.  In this case, it could be an operator instead.
+                    pos = EndOfLinePattern.match(data, pos).end()
+                else:
+                    operand, pos = readObjectFromBuffer(data, pos, None)
+                    operands.append(operand)
 
     def _readInlineImage(self, stream):
         # begin reading just after the "BI" - begin image
@@ -2755,8 +2941,12 @@ class ContentStream(DecodedStreamObject):
 
     def _getData(self):
         newdata = BytesIO()
+        write = newdata.write
+        space = b_(" ")
+        newline = b_("\n")
+        inlineImage = b_("INLINE IMAGE")
         for operands, operator in self.operations:
-            if operator == b_("INLINE IMAGE"):
+            if operator == inlineImage:
                 newdata.write(b_("BI"))
                 dicttext = BytesIO()
                 operands["settings"].writeToStream(dicttext, None)
@@ -2767,13 +2957,13 @@ class ContentStream(DecodedStreamObject):
             else:
                 for op in operands:
                     op.writeToStream(newdata, None)
-                    newdata.write(b_(" "))
-                newdata.write(b_(operator))
-            newdata.write(b_("\n"))
+                    write(space)
+                write(b_(operator))
+            write(newline)
         return newdata.getvalue()
 
     def _setData(self, value):
-        self.__parseContentStream(BytesIO(b_(value)))
+        self.__parseContentStream(b_(value))
 
     _data = property(_getData, _setData)
 
@@ -1,8 +1,15 @@
 import os
 import sys
 import unittest
+import zlib
+from io import BytesIO
 
 from PyPDF2 import PdfFileReader, PdfFileWriter
+from PyPDF2.filters import ASCII85Decode, FlateDecode
+from PyPDF2.pdf import ContentStream, PageObject
+from PyPDF2.generic import (ArrayObject, DecimalObject, DecodedStreamObject, DictionaryObject,
+                            FloatObject, IndirectObject, NameObject, NumberObject, readObject)
+from PyPDF2.utils import b_ as b
 
 
 # Configure path environment
@@ -67,3 +74,183 @@ class AddJsTestCase(unittest.TestCase):
         self.assertIn('/JavaScript', self.pdf_file_writer._root_object['/Names'])
         self.assertIn('/Names', self.pdf_file_writer._root_object['/Names']['/JavaScript'])
         return self.pdf_file_writer._root_object['/Names']['/JavaScript']['/Names'][0]
+
+
+class MergePageTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.page = PdfFileReader(os.path.join(RESOURCE_ROOT, 'crazyones.pdf')).getPage(0)
+        # the content of crazyones.pdf is an array of one stream
+        self.stream = self.page.raw_get('/Contents')[0]
+        self.data = self.stream.getObject().getData()
+        self.page2 = PageObject.createBlankPage(None, 100, 100)
+        self.stream2 = DecodedStreamObject()
+        self.stream2.setData(b'0 0 m 10 10 l S')
+        self.page2[NameObject('/Contents')] = self.stream2
+
+    def test_merge_by_reference(self):
+        self.page.mergePage(self.page2)
+
+        contents = self.page.raw_get('/Contents')
+        self.assertIsInstance(contents, ArrayObject, "mergePage should not join the content streams.")
+        self.assertEqual(len(contents), 6)
+        self.assertIs(contents[1], self.stream, "mergePage should reference the original content stream.")
+        self.assertIs(contents[4], self.stream2)
+        self.assertEqual([contents[i].getData() for i in (0, 2, 3, 5)], [b'q\n', b'\nQ\n', b'q\n', b'\nQ\n'])
+
+        writer = PdfFileWriter()
+        writer.addPage(self.page)
+        output = BytesIO()
+        writer.write(output)
+        page = PdfFileReader(output).getPage(0)
+        self.assertEqual(b''.join(stream.getObject().getData() for stream in page.getContents()),
+                         b'q\n' + self.data + b'\nQ\nq\n0 0 m 10 10 l S\nQ\n')
+
+    def test_merge_transformed(self):
+        self.page.mergeTranslatedPage(self.page2, 10, 20)
+
+        contents = self.page.raw_get('/Contents')
+        self.assertEqual(contents[4].getData(), b'1 0 0 1 10 20 cm\n')
+        self.assertIs(contents[5], self.stream2)
+
+    def test_merge_renamed(self):
+        font = self.page['/Resources']['/Font']
+        name = list(font.keys())[0]
+        self.page2[NameObject('/Resources')] = DictionaryObject({
+            NameObject('/Font'): DictionaryObject({NameObject(name): DictionaryObject()})})
+        self.stream2.setData(b('BT %s 12 Tf ET' % name))
+        self.page.mergePage(self.page2)
+
+        contents = self.page.raw_get('/Contents')
+        self.assertEqual(len(contents), 6)
+        data = contents[4].getData()
+        self.assertNotIn(b(name + ' '), data, "mergePage should rename clashing resources of the merged page.")
+        self.assertEqual(len(self.page['/Resources']['/Font']), len(font) + 1)
+
+    def test_merge_transformed_renamed(self):
+        font = self.page['/Resources']['/Font']
+        name = list(font.keys())[0]
+        self.page2[NameObject('/Resources')] = DictionaryObject({
+            NameObject('/Font'): DictionaryObject({NameObject(name): DictionaryObject()})})
+        self.stream2.setData(b('BT %s 12 Tf ET' % name))
+        self.page.mergeTranslatedPage(self.page2, 10, 20)
+
+        contents = self.page.raw_get('/Contents')
+        self.assertEqual(len(contents), 7)
+        self.assertEqual(contents[4].getData(), b'1 0 0 1 10 20 cm\n')
+        self.assertNotIn(b(name + ' '), contents[5].getData())
+
+
+class ContentStreamTestCase(unittest.TestCase):
+
+    def parse(self, data):
+        stream = DecodedStreamObject()
+        stream.setData(data)
+        return ContentStream(stream, None).operations
+
+    def test_parse(self):
+        operations = self.parse(b'q 1 0 0 1 72.5 -720 cm BT /F1 12 Tf (a\\(b\\)) Tj <414> Tj\n'
+                                b'[(x) -250 (y)] TJ ET %comment\n/P <</MCID 0>> BDC EMC Q')
+        self.assertEqual([operator for _, operator in operations],
+                         [b'q', b'cm', b'BT', b'Tf', b'Tj', b'Tj', b'TJ', b'ET', b'BDC', b'EMC', b'Q'])
+        self.assertEqual(operations[1][0], [1, 0, 0, 1, FloatObject('72.5'), -720])
+        self.assertIsInstance(operations[1][0][0], NumberObject)
+        self.assertEqual(operations[3][0], ['/F1', 12])
+        self.assertEqual(operations[4][0], ['a(b)'])
+        self.assertEqual(operations[5][0], ['A@'])
+        self.assertEqual(operations[6][0], [['x', -250, 'y']])
+        self.assertEqual(operations[8][0], ['/P', {'/MCID': 0}])
+
+    def test_inline_image(self):
+        operations = self.parse(b'q BI /W 2 /H 1 /BPC 8 /CS /G ID \x01\x02 EI Q')
+        self.assertEqual([operator for _, operator in operations], [b'q', b'INLINE IMAGE', b'Q'])
+        self.assertEqual(operations[1][0]['data'], b'\x01\x02 ')
+
+    def test_read_object_without_buffer(self):
+        # streams that are not held in memory are read byte by byte
+        class Stream(BytesIO):
+            getbuffer = None
+        data = b'<< /A [1 2.5 (s) /N] /R 3 0 R >> '
+        for stream in (BytesIO(data), Stream(data)):
+            obj = readObject(stream, None)
+            self.assertEqual(obj['/A'], [1, FloatObject('2.5'), 's', '/N'])
+            self.assertEqual(obj.raw_get('/R'), IndirectObject(3, 0, None))
+            self.assertEqual(stream.tell(), len(data) - 1)
+
+
+class FloatObjectTestCase(unittest.TestCase):
+
+    def write(self, value):
+        stream = BytesIO()
+        FloatObject(value).writeToStream(stream, None)
+        return stream.getvalue()
+
+    def test_write(self):
+        self.assertEqual(self.write(b'72.5'), b'72.5')
+        self.assertEqual(self.write(b'-.25'), b'-0.25')
+        self.assertEqual(self.write(b'4.'), b'4')
+        self.assertEqual(self.write(b'0.667969'), b'0.667969')
+        self.assertEqual(self.write(1e-05), b'0.00001')
+        for value in (0.1 + 0.2, 1 / 3.0, -123.456e-10):
+            self.assertEqual(float(self.write(value)), value, "FloatObject should be written round-trip safe.")
+
+    def test_strict(self):
+        FloatObject.strict = True
+        try:
+            value = FloatObject(b'0.1')
+        finally:
+            FloatObject.strict = False
+        self.assertIsInstance(value, DecimalObject)
+        self.assertEqual(value * 3, DecimalObject('0.3'))
+        self.assertIsInstance(FloatObject(b'0.1'), float)
+
+
+class FiltersTestCase(unittest.TestCase):
+
+    def test_ascii85(self):
+        self.assertEqual(ASCII85Decode.decode(b'87cURD]i,"Ebo80~>'), b'Hello World!')
+        self.assertEqual(ASCII85Decode.decode(b'<~87cU\nRD]i,\r\n"Ebo80~>\n'), b'Hello World!')
+        self.assertEqual(ASCII85Decode.decode(b'z!!~>'), b'\x00' * 5)
+        self.assertEqual(ASCII85Decode.decode(b'87cURD]i,"Ebo80AR~>'), b'Hello World!e')
+        # 'z' may only stand for a whole group
+        self.assertRaises(AssertionError, ASCII85Decode.decode, b'!!z!!!~>')
+
+    @unittest.skipIf(sys.version_info < (3, 0), "Python 3 decoder")
+    def test_ascii85_py3(self):
+        data = bytes(range(256)) * 3 + b'\x00' * 8 + b'xy'
+        self.assertEqual(ASCII85Decode.decode(ASCII85Decode.encode(data)), data)
+        # invalid characters are skipped
+        self.assertEqual(ASCII85Decode.decode(b'87cURD]i,"Ebo80\xff~>'), b'Hello World!')
+        # without an end of data marker a partial group is dropped
+        self.assertEqual(ASCII85Decode.decode(b'87cURD]i,"Ebo80AR'), b'Hello World!')
+
+    def test_png_predictor(self):
+        rows = [b'\x01\x02\x03\x04', b'\xff\x00\x10\x80', b'\x05\x05\x05\x05']
+        # none, sub and up
+        encoded = (b'\x00' + rows[0] +
+                   b'\x01' + b'\xff\x01\x10\x70' +
+                   b'\x02' + b'\x06\x05\xf5\x85')
+        data = FlateDecode.decode(zlib.compress(encoded), {'/Predictor': 12, '/Columns': 4})
+        self.assertEqual(data, b''.join(rows))
+
+
+class ObjectStreamsTestCase(unittest.TestCase):
+
+    def write(self, useObjectStreams):
+        writer = PdfFileWriter(useObjectStreams=useObjectStreams)
+        writer.appendPagesFromReader(PdfFileReader(os.path.join(RESOURCE_ROOT, 'crazyones.pdf')))
+        output = BytesIO()
+        writer.write(output)
+        return output.getvalue()
+
+    def test_write(self):
+        data = self.write(True)
+        self.assertTrue(data.startswith(b('%PDF-1.5\n')))
+        self.assertNotIn(b('\nxref\n'), data)
+        self.assertLess(len(data), len(self.write(False)))
+
+        reader = PdfFileReader(BytesIO(data))
+        self.assertEqual(reader.trailer['/Root']['/Type'], '/Catalog')
+        self.assertTrue(reader.xref_objStm)
+        self.assertEqual(reader.getPage(0).extractText(),
+                         PdfFileReader(BytesIO(self.write(False))).getPage(0).extractText())
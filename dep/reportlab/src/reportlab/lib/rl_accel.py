@@ -32,6 +32,8 @@ if _py_funcs:
     from reportlab.lib.utils import isBytes, isUnicode, isSeq, isPy3, rawBytes, asNative, asUnicode, asBytes
     from math import log
     from struct import unpack
+    from array import array
+    import sys
 
 if 'fp_str' in _py_funcs:
     _log_10 = lambda x,log=log,_log_e_10=log(10.0): log(x)/_log_e_10
@@ -128,11 +130,20 @@ if 'add32' in _py_funcs:
     _py_funcs['add32'] = add32
 
 if 'calcChecksum' in _py_funcs:
+    _uint32 = 'I' if array('I').itemsize==4 else 'L'
     def calcChecksum(data):
         """Calculates TTF-style checksums"""
         data = rawBytes(data)
-        if len(data)&3: data = data + (4-(len(data)&3))*b"\0"
-        return sum(unpack(">%dl" % (len(data)>>2), data)) & 0xFFFFFFFF
+        if len(data)&3: data = b''.join((data, (4-(len(data)&3))*b"\0"))
+        # sum the data as an array of 32 bit words rather than unpacking it
+        words = array(_uint32)
+        if isPy3:
+            words.frombytes(data)
+        else:
+            words.fromstring(bytes(data))
+        if sys.byteorder == 'little':
+            words.byteswap()
+        return sum(words) & 0xFFFFFFFF
     _py_funcs['calcChecksum'] = calcChecksum
 
 if 'escapePDF' in _py_funcs:
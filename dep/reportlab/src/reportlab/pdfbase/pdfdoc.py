@@ -1964,18 +1964,18 @@ class PDFTrueTypeFont(PDFType1Font):
 ##    Subtype = "Type3"
 ##    local_attributes = "FirstChar LastChar Widths CharProcs FontBBox FontMatrix Resources Encoding".split()
 ##
-##class PDFType0Font(PDFType1Font):
-##    Subtype = "Type0"
-##    local_attributes = "DescendantFonts Encoding".split(
-##
+class PDFType0Font(PDFType1Font):
+    Subtype = "Type0"
+    local_attributes = "DescendantFonts Encoding ToUnicode".split()
+
 ##class PDFCIDFontType0(PDFType1Font):
 ##    Subtype = "CIDFontType0"
 ##    local_attributes = "CIDSystemInfo FontDescriptor DW W DW2 W2 Registry Ordering Supplement".split()
 ##
-##class PDFCIDFontType0(PDFType1Font):
-##    Subtype = "CIDFontType2"
-##    local_attributes = "BaseFont CIDToGIDMap CIDSystemInfo FontDescriptor DW W DW2 W2".split()
-##
+class PDFCIDFontType2(PDFType1Font):
+    Subtype = "CIDFontType2"
+    local_attributes = "CIDToGIDMap CIDSystemInfo FontDescriptor DW W DW2 W2".split()
+
 ##class PDFEncoding(PDFType1Font):
 ##    Type = "Encoding"
 ##    name_attributes = "Type BaseEncoding".split()
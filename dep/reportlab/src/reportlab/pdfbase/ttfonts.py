@@ -51,13 +51,20 @@ Oh, and that 14 up there is font size.)
 Canvas and TextObject have special support for dynamic fonts.
 """
 
-from struct import pack, unpack, error as structError
+from struct import pack, pack_into, unpack, unpack_from, error as structError
+from bisect import bisect_left
 from reportlab.lib.utils import getBytesIO, isPy3, bytestr, isUnicode, char2int
 from reportlab.pdfbase import pdfmetrics, pdfdoc
 from reportlab import rl_config
 from reportlab.lib.rl_accel import hex32, add32, calcChecksum, instanceStringWidthTTF
-from collections import namedtuple
-import time
+from collections import namedtuple, OrderedDict
+from itertools import repeat
+from array import array
+try:
+    from collections.abc import Mapping, Sequence
+except ImportError:
+    from collections import Mapping, Sequence
+import os, sys, time, mmap, marshal, hashlib, tempfile, threading
 
 class TTFError(pdfdoc.PDFError):
     "TrueType font exception"
@@ -101,10 +108,73 @@ def makeToUnicodeCMap(fontname, subset):
         ]
     return '\n'.join(cmap)
 
+def _utf16Hex(code):
+    "Returns code as UTF-16BE hex digits, using a surrogate pair above U+FFFF"
+    if code < 0x10000:
+        return "%04X" % code
+    code -= 0x10000
+    return "%04X%04X" % (0xD800 | (code >> 10), 0xDC00 | (code & 0x3FF))
+
+def makeToUnicodeCIDCMap(fontname, subset):
+    """Creates a ToUnicode CMap for a CID font subset made by a TTFont in
+    CID mode, where CID n+1 shows the character subset[n]."""
+    cmap = [
+        "/CIDInit /ProcSet findresource begin",
+        "12 dict begin",
+        "begincmap",
+        "/CIDSystemInfo",
+        "<< /Registry (Adobe)",
+        "/Ordering (UCS)",
+        "/Supplement 0",
+        ">> def",
+        "/CMapName /%s def" % fontname,
+        "/CMapType 2 def",
+        "1 begincodespacerange",
+        "<0000> <FFFF>",
+        "endcodespacerange",
+        ]
+    # no more than 100 entries are allowed in one bfchar block
+    for i in xrange(0, len(subset), 100):
+        chunk = subset[i:i+100]
+        cmap.append("%d beginbfchar" % len(chunk))
+        cmap.extend(["<%04X> <%s>" % (cid, _utf16Hex(v)) for cid, v in enumerate(chunk, i + 1)])
+        cmap.append("endbfchar")
+    cmap.extend([
+        "endcmap",
+        "CMapName currentdict /CMap defineresource pop",
+        "end",
+        "end"
+        ])
+    return '\n'.join(cmap)
+
+def makeCIDWidths(widths, firstCID=1):
+    """Returns a CIDFont W array for consecutive CIDs starting at firstCID.
+    Runs of equal widths become "first last width" ranges and the rest
+    "first [widths]" lists."""
+    W = []
+    pending = None
+    n = len(widths)
+    i = 0
+    while i < n:
+        w = widths[i]
+        j = i + 1
+        while j < n and widths[j] == w:
+            j += 1
+        if j - i > 1:
+            W.extend([firstCID + i, firstCID + j - 1, w])
+            pending = None
+        else:
+            if pending is None:
+                pending = []
+                W.extend([firstCID + i, pending])
+            pending.append(w)
+        i = j
+    return [pdfdoc.PDFArray(x) if isinstance(x, list) else x for x in W]
+
 def splice(stream, offset, value):
     """Splices the given value into stream at the given offset and
     returns the resulting stream (the original is unchanged)"""
-    return stream[:offset] + value + stream[offset + len(value):]
+    return b''.join((stream[:offset], value, stream[offset + len(value):]))
 
 def _set_ushort(stream, offset, value):
     """Writes the given unsigned short value into stream at the given
@@ -146,18 +216,51 @@ def TTFOpenFile(fn):
                     return tfn, f
         raise TTFError('Can\'t open file "%s"' % fn)
 
+def TTFMapFile(f):
+    """Returns a read only memory map of the open file f, as a memoryview
+    under Python 3, or None if f cannot be mapped (eg it is not a real file)
+    """
+    try:
+        fd = f.fileno()
+    except (AttributeError, EnvironmentError, ValueError):
+        return None
+    try:
+        m = mmap.mmap(fd, 0, access=mmap.ACCESS_READ)
+    except (EnvironmentError, ValueError):
+        return None
+    return memoryview(m) if isPy3 else m
+
+def _calcChecksum(data):
+    """calcChecksum of any buffer.  calcChecksum only accepts read only bytes,
+    but tables may be bytearrays or, when memory mapped, memoryviews, and
+    under Python 2 the whole file may be an mmap.
+    """
+    if isinstance(data, memoryview):
+        data = data.tobytes()
+    elif isinstance(data, bytearray):
+        data = bytes(data)
+    elif isinstance(data, mmap.mmap):
+        data = data[:]
+    return calcChecksum(data)
+
 class TTFontParser:
     "Basic TTF file parser"
     ttfVersions = (0x00010000,0x74727565,0x74746366)
     ttcVersions = (0x00010000,0x00020000)
     fileKind='TTF'
 
-    def __init__(self, file, validate=0,subfontIndex=0):
+    def __init__(self, file, validate=0,subfontIndex=0,useMmap=None):
         """Loads and parses a TrueType font file.  file can be a filename or a
         file object.  If validate is set to a false values, skips checksum
         validation.  This can save time, especially if the font is large.
+        If useMmap is set, a font given by filename is memory mapped rather
+        than read, so processes using the same font share its pages and
+        tables are sliced without copying; see rl_config.ttfUseMmap.
         """
         self.validate = validate
+        if useMmap is None:
+            useMmap = rl_config.ttfUseMmap
+        self.useMmap = useMmap
         self.readFile(file)
         self._filename = getattr(file,'name','')
         if self._filename.startswith('<'):
@@ -237,7 +340,8 @@ class TTFontParser:
             self._ttf_data = f.read()
         else:
             self.filename, f = TTFOpenFile(f)
-            self._ttf_data = f.read()
+            data = TTFMapFile(f) if self.useMmap else None
+            self._ttf_data = f.read() if data is None else data
             f.close()
         self._pos = 0
 
@@ -245,7 +349,7 @@ class TTFontParser:
         # Check the checksums for all tables
         for t in self.tables:
             table = self.get_chunk(t['offset'], t['length'])
-            checksum = calcChecksum(table)
+            checksum = _calcChecksum(table)
             if t['tag'] == 'head':
                 adjustment = unpack('>l', table[8:8+4])[0]
                 checksum = add32(checksum, -adjustment)
@@ -255,7 +359,7 @@ class TTFontParser:
 
     def checksumFile(self):
         # Check the checksums for the whole file
-        checksum = calcChecksum(self._ttf_data)
+        checksum = _calcChecksum(self._ttf_data)
         if 0xB1B0AFBA!=checksum:
             raise TTFError('TTF file "%s": invalid checksum %s (expected 0xB1B0AFBA) len: %d &3: %d' % (self.filename,hex32(checksum),len(self._ttf_data),(len(self._ttf_data)&3)))
 
@@ -332,11 +436,63 @@ class TTFontParser:
         "Return an unsigned long at given position"
         return unpack('>L',self._ttf_data[pos:pos+4])[0]
 
+    def get_array(self, pos, typecode, count):
+        """Return count big endian values at given position as an array of
+        the given typecode, decoded in one go"""
+        a = array(typecode)
+        end = pos + count * a.itemsize
+        if end > len(self._ttf_data):
+            raise TTFError('Unexpected end of font data reading %d values at %d' % (count, pos))
+        _arrayFromBytes(a, self._ttf_data[pos:end])
+        if sys.byteorder == 'little':
+            a.byteswap()
+        return a
+
+    def read_array(self, typecode, count):
+        "Reads count big endian values into an array of the given typecode"
+        a = self.get_array(self._pos, typecode, count)
+        self._pos += count * a.itemsize
+        return a
+
     def get_table(self, tag):
-        "Return the given TTF table"
+        "Return the given TTF table (a memoryview if the file is memory mapped)"
         pos, length = self.get_table_pos(tag)
         return self._ttf_data[pos:pos+length]
 
+if isPy3:
+    _arrayToBytes = lambda a: a.tobytes()
+    _arrayFromBytes = lambda a, data: a.frombytes(data)
+else:
+    _arrayToBytes = lambda a: a.tostring()
+    _arrayFromBytes = lambda a, data: a.fromstring(data)
+
+def _arrayToBigEndian(a):
+    "Returns the items of array a as big endian bytes, the order of TrueType tables"
+    if sys.byteorder == 'little':
+        a = array(a.typecode, a)
+        a.byteswap()
+    return _arrayToBytes(a)
+
+def _packIndexValue(value):
+    "converts the arrays of a TTFontFile into values marshal can store"
+    if isinstance(value, GlyphTable):
+        return ('GlyphTable', _packIndexValue(value._blockIndex), _packIndexValue(value._values), value._count)
+    if isinstance(value, array):
+        return ('array', value.typecode, _arrayToBytes(value))
+    return value
+
+def _unpackIndexValue(value):
+    "reverses _packIndexValue"
+    if isinstance(value, tuple) and value:
+        if value[0] == 'GlyphTable':
+            return GlyphTable(blockIndex=_unpackIndexValue(value[1]),
+                              values=_unpackIndexValue(value[2]), count=value[3])
+        if value[0] == 'array':
+            a = array(value[1])
+            _arrayFromBytes(a, value[2])
+            return a
+    return value
+
 class TTFontMaker:
     "Basic TTF file generator"
 
@@ -351,10 +507,12 @@ class TTFontMaker:
         self.tables[tag] = data
 
     def makeStream(self):
-        "Finishes the generation and returns the TTF file as a string"
-        stm = getBytesIO()
-        write = stm.write
+        """Finishes the generation and returns the TTF file as a string.
 
+        The file is assembled in a single preallocated buffer.  Tables start
+        on 4 byte boundaries and are padded with zeros, so the checksum of the
+        whole file is the sum of the table checksums and that of the header,
+        and the tables are only summed once."""
         tables = self.tables
         numTables = len(tables)
         searchRange = 1
@@ -365,54 +523,383 @@ class TTFontMaker:
         searchRange = searchRange * 16
         rangeShift = numTables * 16 - searchRange
 
-        # Header
-        write(pack(">lHHHH", 0x00010000, numTables, searchRange,
-                                 entrySelector, rangeShift))
-
-        # Table directory
-        offset = 12 + numTables * 16
-        wStr = (lambda x:write(bytes(tag,'latin1'))) if isPy3 else write
         tables_items = list(sorted(tables.items()))
+        headerLength = 12 + numTables * 16
+        length = headerLength
         for tag, data in tables_items:
-            if tag == 'head':
-                head_start = offset
-            checksum = calcChecksum(data)
-            wStr(tag)
-            write(pack(">LLL", checksum, offset, len(data)))
-            paddedLength = (len(data)+3)&~3
-            offset = offset + paddedLength
+            length += (len(data)+3)&~3
+        stm = bytearray(length)
 
-        # Table data
+        # Header
+        pack_into(">lHHHH", stm, 0, 0x00010000, numTables, searchRange,
+                                 entrySelector, rangeShift)
+
+        # Table directory and table data
+        checksum = 0
+        entry = 12
+        offset = headerLength
+        head_start = None
         for tag, data in tables_items:
-            data += b"\0\0\0"
-            write(data[:len(data)&~3])
+            if tag == 'head':
+                head_start = offset
+            tableChecksum = _calcChecksum(data)
+            checksum += tableChecksum
+            pack_into(">4sLLL", stm, entry, tag.encode('latin1') if isPy3 else tag,
+                                     tableChecksum, offset, len(data))
+            entry += 16
+            stm[offset:offset+len(data)] = data
+            offset += (len(data)+3)&~3
 
-        checksum = calcChecksum(stm.getvalue())
-        checksum = add32(0xB1B0AFBA, -checksum)
-        stm.seek(head_start + 8)
-        write(pack('>L', checksum))
+        if head_start is not None:
+            checksum = add32(checksum, _calcChecksum(stm[:headerLength]))
+            pack_into('>L', stm, head_start + 8, add32(0xB1B0AFBA, -checksum))
 
-        return stm.getvalue()
+        return bytes(stm)
 
 #this is used in the cmap encoding fmt==2 case
 CMapFmt2SubHeader = namedtuple('CMapFmt2SubHeader', 'firstCode entryCount idDelta idRangeOffset')
 
+#typecode of an array of unsigned 32 bit integers
+_UINT32 = 'I' if array('I').itemsize>=4 else 'L'
+
+class GlyphTable(Mapping):
+    """Compact read only mapping of character codes to glyph indexes.
+
+    Codes are grouped in blocks of 256; only the blocks that contain at
+    least one mapped code are stored, as consecutive runs of an array.
+    This takes a small fraction of the memory of a dict for fonts with
+    tens of thousands of glyphs."""
+    _missing = 0xFFFFFFFF
+
+    def __init__(self, charToGlyph=None, blockIndex=None, values=None, count=None):
+        if charToGlyph is not None:
+            # each used block is filled with one lookup per code, not per mapped code
+            blocks = sorted(set(map((8).__rrshift__, charToGlyph)))
+            blockIndex = array('i', [-1]) * (blocks[-1] + 1 if blocks else 0)
+            values = array(_UINT32)
+            get = charToGlyph.get
+            missing = self._missing
+            for block in blocks:
+                blockIndex[block] = len(values)
+                values.extend(map(get, xrange(block << 8, (block + 1) << 8), repeat(missing, 256)))
+            count = len(charToGlyph)
+        self._blockIndex = blockIndex
+        self._values = values
+        self._count = count
+
+    def get(self, code, default=None):
+        block = code >> 8
+        if 0 <= block < len(self._blockIndex):
+            offset = self._blockIndex[block]
+            if offset >= 0:
+                glyph = self._values[offset + (code & 0xFF)]
+                if glyph != self._missing:
+                    return glyph
+        return default
+
+    def __getitem__(self, code):
+        glyph = self.get(code)
+        if glyph is None:
+            raise KeyError(code)
+        return glyph
+
+    def __contains__(self, code):
+        return self.get(code) is not None
+
+    def __iter__(self):
+        values = self._values
+        missing = self._missing
+        for block, offset in enumerate(self._blockIndex):
+            if offset >= 0:
+                for i in xrange(256):
+                    if values[offset + i] != missing:
+                        yield (block << 8) | i
+
+    def __len__(self):
+        return self._count
+
+    def __eq__(self, other):
+        if isinstance(other, GlyphTable):
+            return (self._count == other._count and self._blockIndex == other._blockIndex
+                    and self._values == other._values)
+        return Mapping.__eq__(self, other)
+
+    __hash__ = None
+
+class LazyGlyphTable(Mapping):
+    """Read only mapping of character codes to glyph indexes that decodes
+    a cmap subtable only for the codes that are looked up.
+
+    Only the segment boundaries are read in advance; the glyphs found are
+    memoized.  Iterating over it decodes the whole subtable once."""
+    formats = (4, 12, 13)
+
+    def __init__(self, ttf, encoffs, cmap_offset):
+        self._ttf = ttf
+        self._encoffs = encoffs
+        self._cmap_offset = cmap_offset
+        self._data = data = ttf._ttf_data
+        self._cache = {}
+        self._table = None
+        self._format = fmt = unpack_from('>H', data, encoffs)[0]
+        if fmt == 4:
+            self._limit = encoffs + unpack_from('>H', data, encoffs + 2)[0]
+            segCount = unpack_from('>H', data, encoffs + 6)[0] >> 1
+            pos = encoffs + 14
+            self._ends = array('H', unpack_from('>%dH' % segCount, data, pos))
+            self._starts = array('H', unpack_from('>%dH' % segCount, data, pos + 2 + 2*segCount))
+            self._idDeltas = array('h', unpack_from('>%dh' % segCount, data, pos + 2 + 4*segCount))
+            self._idRangeOffsets_start = pos + 2 + 6*segCount
+            self._idRangeOffsets = array('H', unpack_from('>%dH' % segCount, data, self._idRangeOffsets_start))
+        else:
+            nGroups = unpack_from('>L', data, encoffs + 12)[0]
+            groups = unpack_from('>%dL' % (3*nGroups), data, encoffs + 16)
+            self._starts = array(_UINT32, groups[0::3])
+            self._ends = array(_UINT32, groups[1::3])
+            self._glyphs = array(_UINT32, groups[2::3])
+
+    def _lookup(self, code):
+        i = bisect_left(self._ends, code)
+        if i == len(self._ends) or self._starts[i] > code:
+            return None
+        fmt = self._format
+        if fmt == 12:
+            return self._glyphs[i] + code - self._starts[i]
+        if fmt == 13:
+            return self._glyphs[i]
+        if self._idRangeOffsets[i] == 0:
+            return (code + self._idDeltas[i]) & 0xFFFF
+        offset = self._idRangeOffsets_start + 2*i + (code - self._starts[i])*2 + self._idRangeOffsets[i]
+        if offset >= self._limit:
+            # workaround for broken fonts (like Thryomanes)
+            return 0
+        glyph = unpack_from('>H', self._data, offset)[0]
+        if glyph != 0:
+            glyph = (glyph + self._idDeltas[i]) & 0xFFFF
+        return glyph
+
+    def get(self, code, default=None):
+        try:
+            glyph = self._cache[code]
+        except KeyError:
+            glyph = self._cache[code] = self._lookup(code)
+        return default if glyph is None else glyph
+
+    def __getitem__(self, code):
+        glyph = self.get(code)
+        if glyph is None:
+            raise KeyError(code)
+        return glyph
+
+    def __contains__(self, code):
+        return self.get(code) is not None
+
+    def _getTable(self):
+        if self._table is None:
+            self._table = GlyphTable(self._ttf._decodeCmap(self._encoffs, self._cmap_offset))
+        return self._table
+
+    def __iter__(self):
+        return iter(self._getTable())
+
+    def __len__(self):
+        return len(self._getTable())
+
+    __hash__ = None
+
+class LazyArray(Sequence):
+    "Read only sequence of length n whose items are computed by getter when they are used"
+
+    def __init__(self, getter, n):
+        self._getter = getter
+        self._n = n
+
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            return [self._getter(j) for j in xrange(*i.indices(self._n))]
+        if i < 0:
+            i += self._n
+        if not 0 <= i < self._n:
+            raise IndexError('LazyArray index out of range')
+        return self._getter(i)
+
+    def __len__(self):
+        return self._n
+
+class LRUCache(object):
+    "Thread safe mapping that keeps at most maxsize of the most recently used items"
+
+    def __init__(self, maxsize):
+        self.maxsize = maxsize
+        self._items = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key, default=None):
+        with self._lock:
+            try:
+                value = self._items.pop(key)
+            except KeyError:
+                return default
+            self._items[key] = value
+            return value
+
+    def put(self, key, value):
+        if self.maxsize <= 0: return
+        with self._lock:
+            self._items.pop(key, None)
+            self._items[key] = value
+            while len(self._items) > self.maxsize:
+                self._items.popitem(last=False)
+
+    def __len__(self):
+        return len(self._items)
+
+class CharWidths(Mapping):
+    """Read only mapping of character codes to widths in 1/1000ths of a
+    point, computed from the glyph table and the advance widths"""
+
+    def __init__(self, charToGlyph, advanceWidths, unitsPerEm):
+        self._charToGlyph = charToGlyph
+        self._advanceWidths = advanceWidths
+        self._unitsPerEm = unitsPerEm
+
+    def get(self, code, default=None):
+        glyph = self._charToGlyph.get(code)
+        if glyph is None or glyph >= len(self._advanceWidths):
+            return default
+        return self._advanceWidths[glyph] * 1000. / self._unitsPerEm
+
+    def __getitem__(self, code):
+        width = self.get(code)
+        if width is None:
+            raise KeyError(code)
+        return width
+
+    def __contains__(self, code):
+        return self.get(code) is not None
+
+    def __iter__(self):
+        numGlyphs = len(self._advanceWidths)
+        charToGlyph = self._charToGlyph
+        return (code for code in charToGlyph if charToGlyph[code] < numGlyphs)
+
+    def __len__(self):
+        return sum(1 for code in self)
+
+    __hash__ = None
+
+class HMetrics(Sequence):
+    "Read only sequence of the (advance width, left side bearing) of every glyph"
+
+    def __init__(self, advanceWidths, leftSideBearings):
+        self._advanceWidths = advanceWidths
+        self._leftSideBearings = leftSideBearings
+
+    def __getitem__(self, glyph):
+        if isinstance(glyph, slice):
+            return list(zip(self._advanceWidths[glyph], self._leftSideBearings[glyph]))
+        return self._advanceWidths[glyph], self._leftSideBearings[glyph]
+
+    def __len__(self):
+        return len(self._advanceWidths)
+
 class TTFontFile(TTFontParser):
     "TTF file parser and generator"
     _agfnc = 0
     _agfnm = {}
 
-    def __init__(self, file, charInfo=1, validate=0,subfontIndex=0):
+    def __init__(self, file, charInfo=1, validate=0,subfontIndex=0,useMmap=None,lazyCharInfo=None):
         """Loads and parses a TrueType font file.
 
         file can be a filename or a file object.  If validate is set to a false
         values, skips checksum validation.  This can save time, especially if
-        the font is large.  See TTFontFile.extractInfo for more information.
+        the font is large.  If lazyCharInfo is set, character information is
+        only read for the characters that are used; it defaults to
+        rl_config.ttfLazyCharInfo.  See TTFontFile.extractInfo for more information.
         """
-        TTFontParser.__init__(self, file, validate=validate,subfontIndex=subfontIndex)
-        self.extractInfo(charInfo)
-
-    def extractInfo(self, charInfo=1):
+        TTFontParser.__init__(self, file, validate=validate,subfontIndex=subfontIndex,useMmap=useMmap)
+        if lazyCharInfo is None:
+            lazyCharInfo = rl_config.ttfLazyCharInfo
+        if lazyCharInfo:
+            self.extractInfo(charInfo, lazy=1)
+        elif not self.loadIndex(charInfo):
+            self.extractInfo(charInfo)
+            self.saveIndex(charInfo)
+        if charInfo:
+            self.hmetrics = HMetrics(self.advanceWidths, self.leftSideBearings)
+            self.charWidths = CharWidths(self.charToGlyph, self.advanceWidths, self.unitsPerEm)
+        # shared by all the documents using this font
+        self._glyphCache = LRUCache(rl_config.ttfGlyphCacheSize)
+        self._subsetCache = LRUCache(rl_config.ttfSubsetCacheSize)
+
+    # Compiled index
+    #
+    # The information extracted by extractInfo can be kept in a file, so that
+    # later processes load it instead of parsing the font again.  Indexes are
+    # only used if rl_config.ttfIndexDir is not None.  The index records the
+    # sha256 of the font file and is ignored (and rebuilt) when it changes.
+
+    _indexVersion = 2
+    _indexAttrs = ('name', 'familyName', 'styleName', 'fullName', 'uniqueFontID',
+                   'fontRevision', 'unitsPerEm', 'bbox', 'ascent', 'descent',
+                   'capHeight', 'stemV', 'italicAngle', 'underlinePosition',
+                   'underlineThickness', 'flags', 'numGlyphs', 'charToGlyph',
+                   'defaultWidth', 'advanceWidths', 'leftSideBearings', 'glyphPos')
+
+    def getIndexFilename(self):
+        """Returns the name of the compiled index of this font, or None if
+        indexes are disabled or the font was not read from a file.
+        The index is kept next to the font if rl_config.ttfIndexDir is ''."""
+        indexDir = rl_config.ttfIndexDir
+        if indexDir is None or not os.path.isfile(self.filename):
+            return None
+        fn = os.path.abspath(self.filename)
+        if indexDir:
+            fn = os.path.join(indexDir, os.path.basename(fn))
+        return '%s%s.rlidx' % (fn, self.subfontNameX.decode('latin1'))
+
+    def _indexKey(self, charInfo):
+        if not hasattr(self, '_ttfHash'):
+            self._ttfHash = hashlib.sha256(self._ttf_data).hexdigest()
+        return (self._indexVersion, self._ttfHash, bool(charInfo))
+
+    def loadIndex(self, charInfo=1):
+        "Sets the extractInfo attributes from the compiled index; returns false if there is no valid index"
+        fn = self.getIndexFilename()
+        if fn is None: return False
+        try:
+            with open(fn,'rb') as f:
+                key, values = marshal.loads(f.read())
+        except (EnvironmentError, EOFError, ValueError, TypeError):
+            return False
+        if key!=self._indexKey(charInfo) or len(values)!=len(self._indexAttrs):
+            return False
+        for attr, value in zip(self._indexAttrs, values):
+            setattr(self, attr, _unpackIndexValue(value))
+        return True
+
+    def saveIndex(self, charInfo=1):
+        "Writes the extractInfo attributes to the compiled index; failures are ignored"
+        fn = self.getIndexFilename()
+        if fn is None: return
+        values = tuple(_packIndexValue(getattr(self, attr, None)) for attr in self._indexAttrs)
+        try:
+            fd, tfn = tempfile.mkstemp(dir=os.path.dirname(fn), suffix='.tmp')
+            try:
+                with os.fdopen(fd,'wb') as f:
+                    marshal.dump((self._indexKey(charInfo), values), f)
+                if isPy3:
+                    os.replace(tfn, fn)
+                else:
+                    os.rename(tfn, fn)
+            except:
+                os.remove(tfn)
+                raise
+        except (EnvironmentError, ValueError):
+            if rl_config.verbose:
+                print('TTFontFile: cannot write index %s' % fn)
+
+    def extractInfo(self, charInfo=1, lazy=0):
         """
         Extract typographic information from the loaded font file.
 
@@ -438,6 +925,10 @@ class TTFontFile(TTFontParser):
         This will only work if the font has a Unicode cmap (platform 3,
         encoding 1, format 4 or platform 0 any encoding format 4).  Setting
         charInfo to false avoids this requirement
+
+        If lazy is true, only the offsets of the tables are read here; the
+        glyph of a character and the metrics of a glyph are read from the
+        font when they are first used (see LazyGlyphTable and LazyArray).
         
         """
         # name - Naming table
@@ -635,6 +1126,7 @@ class TTFontFile(TTFontParser):
             self.charToGlyph = None
             self.defaultWidth = None
             self.charWidths = None
+            self.advanceWidths = self.leftSideBearings = self.glyphPos = None
             return
 
         if glyphDataFormat != 0:
@@ -667,10 +1159,65 @@ class TTFontFile(TTFontParser):
         if encoffs is None:
             raise TTFError('could not find a suitable cmap encoding')
         encoffs += cmap_offset
+        if lazy and unpack_from('>H', self._ttf_data, encoffs)[0] in LazyGlyphTable.formats:
+            self.charToGlyph = LazyGlyphTable(self, encoffs, cmap_offset)
+        else:
+            self.charToGlyph = GlyphTable(self._decodeCmap(encoffs, cmap_offset))
+
+        if indexToLocFormat not in (0, 1):
+            raise TTFError('Unknown location table format (%d)' % indexToLocFormat)
+        if lazy:
+            self._extractLazyMetrics(numberOfHMetrics, numGlyphs, indexToLocFormat)
+            self.defaultWidth = scale(self.advanceWidths[0])
+            return
+
+        # hmtx - Horizontal metrics table
+        # (needs data from hhea, maxp, and cmap tables)
+        # charWidths is computed from these by TTFontFile.__init__
+        self.seek_table("hmtx")
+        # pairs of advance width and left side bearing.  lsb is actually
+        # signed short, but we don't need it anyway (except for subsetting)
+        hMetrics = self.read_array('H', 2*numberOfHMetrics)
+        self.advanceWidths = advanceWidths = hMetrics[0::2]
+        self.leftSideBearings = leftSideBearings = hMetrics[1::2]
+        self.defaultWidth = scale(advanceWidths[0])
+        if numGlyphs > numberOfHMetrics:
+            # the rest of the table only lists left side bearings;
+            # those glyphs reuse the last advance width
+            n = numGlyphs - numberOfHMetrics
+            advanceWidths.extend(array('H', advanceWidths[-1:]) * n)
+            leftSideBearings.extend(self.read_array('H', n))
+
+        # loca - Index to location
+        self.seek_table('loca')
+        if indexToLocFormat == 0:
+            self.glyphPos = array(_UINT32, [pos << 1 for pos in self.read_array('H', numGlyphs + 1)])
+        else:
+            self.glyphPos = array(_UINT32, self.read_array(_UINT32, numGlyphs + 1))
+
+    def _extractLazyMetrics(self, numberOfHMetrics, numGlyphs, indexToLocFormat):
+        "Sets advanceWidths, leftSideBearings and glyphPos to sequences that read the font when indexed"
+        data = self._ttf_data
+        hmtx = self.get_table_pos('hmtx')[0]
+        lastHMetric = hmtx + 4*(numberOfHMetrics - 1)
+        lsbs = hmtx + 2*numberOfHMetrics
+        n = max(numberOfHMetrics, numGlyphs)
+        self.advanceWidths = LazyArray(lambda glyph: unpack_from('>H', data, min(hmtx + 4*glyph, lastHMetric))[0], n)
+        self.leftSideBearings = LazyArray(lambda glyph: unpack_from('>H', data, hmtx + 4*glyph + 2 if glyph < numberOfHMetrics else lsbs + 2*glyph)[0], n)
+        loca = self.get_table_pos('loca')[0]
+        if indexToLocFormat == 0:
+            self.glyphPos = LazyArray(lambda glyph: unpack_from('>H', data, loca + 2*glyph)[0] << 1, numGlyphs + 1)
+        else:
+            self.glyphPos = LazyArray(lambda glyph: unpack_from('>L', data, loca + 4*glyph)[0], numGlyphs + 1)
+
+    def _decodeCmap(self, encoffs, cmap_offset):
+        """Decodes the whole cmap subtable at encoffs and returns it as a dict.
+        The arrays of the subtable are read in one go and every segment or
+        group is added to the dict as a whole."""
         self.seek(encoffs)
         fmt = self.read_ushort()
-        self.charToGlyph = charToGlyph = {}
-        glyphToChar = {}
+        charToGlyph = {}
+        update = charToGlyph.update
         if fmt in (13,12,10,8):
             self.skip(2)    #padding
             length = self.read_ulong()
@@ -679,72 +1226,62 @@ class TTFontFile(TTFontParser):
             length = self.read_ushort()
             lang = self.read_ushort()
         if fmt==0:
-            T = [self.read_uint8() for i in xrange(length-6)]
-            for unichar in xrange(min(256,self.numGlyphs,len(table))):
-                glyph = T[glyph]
-                charToGlyph[unichar] = glyph
-                glyphToChar.setdefault(glyph,[]).append(unichar)
+            T = self.read_array('B', min(256, length-6))
+            update(enumerate(T))
         elif fmt==4:
             limit = encoffs + length
-            segCount = int(self.read_ushort() / 2.0)
+            segCount = self.read_ushort() >> 1
             self.skip(6)
-            endCount = [self.read_ushort() for _ in xrange(segCount)]
+            endCount = self.read_array('H', segCount)
             self.skip(2)
-            startCount = [self.read_ushort() for _ in xrange(segCount)]
-            idDelta = [self.read_short() for _ in xrange(segCount)]
+            startCount = self.read_array('H', segCount)
+            idDelta = self.read_array('H', segCount)    # glyphs are worked out modulo 65536
             idRangeOffset_start = self._pos
-            idRangeOffset = [self.read_ushort() for _ in xrange(segCount)]
+            idRangeOffset = self.read_array('H', segCount)
 
             # Now it gets tricky.
             for n in xrange(segCount):
-                for unichar in xrange(startCount[n], endCount[n] + 1):
-                    if idRangeOffset[n] == 0:
-                        glyph = (unichar + idDelta[n]) & 0xFFFF
-                    else:
-                        offset = (unichar - startCount[n]) * 2 + idRangeOffset[n]
-                        offset = idRangeOffset_start + 2 * n + offset
-                        if offset >= limit:
-                            # workaround for broken fonts (like Thryomanes)
-                            glyph = 0
-                        else:
-                            glyph = self.get_ushort(offset)
-                            if glyph != 0:
-                                glyph = (glyph + idDelta[n]) & 0xFFFF
-                    charToGlyph[unichar] = glyph
-                    glyphToChar.setdefault(glyph,[]).append(unichar)
+                start = startCount[n]
+                end = endCount[n] + 1
+                if end <= start:
+                    continue
+                delta = idDelta[n]
+                if idRangeOffset[n] == 0:
+                    # glyph = (unichar + idDelta) & 0xFFFF, in at most two runs
+                    first = (start + delta) & 0xFFFF
+                    wrap = min(end, start + 0x10000 - first)
+                    update(zip(xrange(start, wrap), xrange(first, first + wrap - start)))
+                    update(zip(xrange(wrap, end), xrange(0, end - wrap)))
+                else:
+                    offset = idRangeOffset_start + 2 * n + idRangeOffset[n]
+                    # workaround for broken fonts (like Thryomanes): the
+                    # characters whose glyph would be past the end get 0
+                    count = max(0, min(end - start, (limit - offset + 1) >> 1))
+                    glyphs = self.get_array(offset, 'H', count)
+                    if delta:
+                        glyphs = [(glyph + delta) & 0xFFFF if glyph else 0 for glyph in glyphs]
+                    update(zip(xrange(start, start + count), glyphs))
+                    update(dict.fromkeys(xrange(start + count, end), 0))
         elif fmt==6:
             first = self.read_ushort()
             count = self.read_ushort()
-            for glyph in xrange(first,first+count):
-                unichar = self.read_ushort()
-                charToGlyph[unichar] = glyph
-                glyphToChar.setdefault(glyph,[]).append(unichar)
+            update(zip(self.read_array('H', count), xrange(first,first+count)))
         elif fmt==10:
             first = self.read_ulong()
             count = self.read_ulong()
-            for glyph in xrange(first,first+count):
-                unichar = self.read_ushort()
-                charToGlyph[unichar] = glyph
-                glyphToChar.setdefault(glyph,[]).append(unichar)
+            update(zip(self.read_array('H', count), xrange(first,first+count)))
         elif fmt==12:
             segCount = self.read_ulong()
-            for n in xrange(segCount):
-                start = self.read_ulong()
-                end = self.read_ulong()
-                inc = self.read_ulong() - start
-                for unichar in xrange(start,end+1):
-                    glyph = unichar + inc
-                    charToGlyph[unichar] = glyph
-                    glyphToChar.setdefault(glyph,[]).append(unichar)
+            groups = self.read_array(_UINT32, 3*segCount)
+            for n in xrange(0, 3*segCount, 3):
+                start, end, glyph = groups[n:n+3]
+                update(zip(xrange(start,end+1), xrange(glyph,glyph+end+1-start)))
         elif fmt==13:
             segCount = self.read_ulong()
-            for n in xrange(segCount):
-                start = self.read_ulong()
-                end = self.read_ulong()
-                gid = self.read_ulong()
-                for unichar in xrange(start,end+1):
-                    charToGlyph[unichar] = gid
-                    glyphToChar.setdefault(gid,[]).append(unichar)
+            groups = self.read_array(_UINT32, 3*segCount)
+            for n in xrange(0, 3*segCount, 3):
+                start, end, gid = groups[n:n+3]
+                update(dict.fromkeys(xrange(start,end+1), gid))
         elif fmt==2:
             T = [self.read_ushort() for i in xrange(256)]   #subheader keys
             maxSHK = max(T)
@@ -774,7 +1311,6 @@ class TTFontFile(TTFontParser):
                     #assume the single byte codes are ascii
                     if glyph!=0 and glyph<self.numGlyphs:
                         charToGlyph[unichar] = glyph
-                        glyphToChar.setdefault(glyph,[]).append(unichar)
                 else:
                     k = T[unichar]
                     for j in xrange(SH[k].entryCount):
@@ -787,111 +1323,119 @@ class TTFontFile(TTFontParser):
                         if glyph!=0 and glyph<self.numGlyphs:
                             enc = (unichar<<8)|(j+SH[k].firstCode)
                             charToGlyph[enc] = glyph
-                            glyphToChar.setdefault(glyph,[]).append(enc)
                     if last==-1:
                         last = unichar
         else:
             raise ValueError('Unsupported cmap encoding format %d' % fmt)
-
-        # hmtx - Horizontal metrics table
-        # (needs data from hhea, maxp, and cmap tables)
-        self.seek_table("hmtx")
-        aw = None
-        self.charWidths = {}
-        self.hmetrics = []
-        for glyph in xrange(numberOfHMetrics):
-            # advance width and left side bearing.  lsb is actually signed
-            # short, but we don't need it anyway (except for subsetting)
-            aw, lsb = self.read_ushort(), self.read_ushort()
-            self.hmetrics.append((aw, lsb))
-            aw = scale(aw)
-            if glyph == 0:
-                self.defaultWidth = aw
-            if glyph in glyphToChar:
-                for char in glyphToChar[glyph]:
-                    self.charWidths[char] = aw
-        for glyph in xrange(numberOfHMetrics, numGlyphs):
-            # the rest of the table only lists advance left side bearings.
-            # so we reuse aw set by the last iteration of the previous loop
-            lsb = self.read_ushort()
-            self.hmetrics.append((aw, lsb))
-            if glyph in glyphToChar:
-                for char in glyphToChar[glyph]:
-                    self.charWidths[char] = aw
-
-        # loca - Index to location
-        self.seek_table('loca')
-        self.glyphPos = []
-        if indexToLocFormat == 0:
-            for n in xrange(numGlyphs + 1):
-                self.glyphPos.append(self.read_ushort() << 1)
-        elif indexToLocFormat == 1:
-            for n in xrange(numGlyphs + 1):
-                self.glyphPos.append(self.read_ulong())
-        else:
-            raise TTFError('Unknown location table format (%d)' % indexToLocFormat)
+        return charToGlyph
 
     # Subsetting
 
+    def getGlyphRecord(self, glyph):
+        """Returns the glyf data of glyph and, for a composite glyph, the
+        (offset in data, glyph index) of every component reference.
+        Records are kept in an LRUCache shared by all subsets."""
+        record = self._glyphCache.get(glyph)
+        if record is not None:
+            return record
+        glyphPos = self.glyphPos[glyph]
+        glyphLen = self.glyphPos[glyph + 1] - glyphPos
+        start = self.get_table_pos('glyf')[0] + glyphPos
+        data = bytes(self._ttf_data[start:start+glyphLen])
+        components = []
+        if glyphLen > 2 and unpack_from(">h", data)[0] < 0:
+            # composite glyph
+            pos_in_glyph = 10
+            flags = GF_MORE_COMPONENTS
+            while flags & GF_MORE_COMPONENTS:
+                flags, glyphIdx = unpack_from(">HH", data, pos_in_glyph)
+                components.append((pos_in_glyph + 2, glyphIdx))
+                pos_in_glyph = pos_in_glyph + 4
+                if flags & GF_ARG_1_AND_2_ARE_WORDS:
+                    pos_in_glyph = pos_in_glyph + 4
+                else:
+                    pos_in_glyph = pos_in_glyph + 2
+                if flags & GF_WE_HAVE_A_SCALE:
+                    pos_in_glyph = pos_in_glyph + 2
+                elif flags & GF_WE_HAVE_AN_X_AND_Y_SCALE:
+                    pos_in_glyph = pos_in_glyph + 4
+                elif flags & GF_WE_HAVE_A_TWO_BY_TWO:
+                    pos_in_glyph = pos_in_glyph + 8
+        record = data, tuple(components)
+        self._glyphCache.put(glyph, record)
+        return record
+
     def makeSubset(self, subset):
-        """Create a subset of a TrueType font"""
+        """Create a subset of a TrueType font.  Glyphs are numbered in the
+        same order for any ordering of subset, so only the cmap depends on
+        it; the other tables are kept in an LRUCache and shared by every
+        subset of the same characters, across documents."""
+        tables, glyphSet = self._getSubsetTables(subset)
         output = TTFontMaker()
+        for tag, data in tables:
+            output.add(tag, data)
+
+        # cmap - Character to glyph mapping
+        # XXX maybe use format 0 if possible, not 6?
+        entryCount = len(subset)
+        length = 10 + entryCount * 2
+        charToGlyph = self.charToGlyph
+        cmap = [0, 1,           # version, number of tables
+                1, 0, 0,12,     # platform, encoding, offset (hi,lo)
+                6, length, 0,   # format, length, language
+                0,
+                entryCount] + \
+               [glyphSet[charToGlyph.get(code, 0)] for code in subset]
+        cmap = pack(*([">%dH" % len(cmap)] + cmap))
+        output.add('cmap', cmap)
+
+        return output.makeStream()
+
+    def getSubsetGlyphs(self, subset):
+        """Returns the glyph index of every character of subset in the font
+        makeSubset(subset) returns."""
+        glyphSet = self._getSubsetTables(subset)[1]
+        charToGlyph = self.charToGlyph
+        return [glyphSet[charToGlyph.get(code, 0)] for code in subset]
+
+    def _getSubsetTables(self, subset):
+        key = tuple(sorted(set(subset)))
+        tables = self._subsetCache.get(key)
+        if tables is None:
+            tables = self._makeSubsetTables(key)
+            self._subsetCache.put(key, tables)
+        return tables
+
+    def _makeSubsetTables(self, codes):
+        """Returns the tables of the subset of the characters codes but its
+        cmap, as a list of (tag, data), and a dict mapping glyph indexes of
+        the font to those of the subset."""
+        output = []
 
         # Build a mapping of glyphs in the subset to glyph numbers in
-        # the original font.  Also build a mapping of UCS codes to
-        # glyph values in the new font.
+        # the original font, in the order of the original glyph numbers.
 
         # Start with 0 -> 0: "missing character"
-        glyphMap = [0]                  # new glyph index -> old glyph index
-        glyphSet = {0:0}                # old glyph index -> new glyph index
-        codeToGlyph = {}                # unicode -> new glyph index
-        for code in subset:
-            if code in self.charToGlyph:
-                originalGlyphIdx = self.charToGlyph[code]
-            else:
-                originalGlyphIdx = 0
-            if originalGlyphIdx not in glyphSet:
-                glyphSet[originalGlyphIdx] = len(glyphMap)
-                glyphMap.append(originalGlyphIdx)
-            codeToGlyph[code] = glyphSet[originalGlyphIdx]
+        charToGlyph = self.charToGlyph
+        glyphMap = [0] + sorted(set(charToGlyph.get(code, 0) for code in codes) - set([0]))
+        glyphSet = dict((glyphIdx, n) for n, glyphIdx in enumerate(glyphMap))
 
         # Also include glyphs that are parts of composite glyphs
-        start = self.get_table_pos('glyf')[0]
+        records = []                    # new glyph index -> glyph record
         n = 0
         while n < len(glyphMap):
-            originalGlyphIdx = glyphMap[n]
-            glyphPos = self.glyphPos[originalGlyphIdx]
-            glyphLen = self.glyphPos[originalGlyphIdx + 1] - glyphPos
+            record = self.getGlyphRecord(glyphMap[n])
+            records.append(record)
+            for pos_in_glyph, glyphIdx in record[1]:
+                if glyphIdx not in glyphSet:
+                    glyphSet[glyphIdx] = len(glyphMap)
+                    glyphMap.append(glyphIdx)
             n += 1
-            if not glyphLen: continue
-            self.seek(start + glyphPos)
-            numberOfContours = self.read_short()
-            if numberOfContours < 0:
-                # composite glyph
-                self.skip(8)
-                flags = GF_MORE_COMPONENTS
-                while flags & GF_MORE_COMPONENTS:
-                    flags = self.read_ushort()
-                    glyphIdx = self.read_ushort()
-                    if glyphIdx not in glyphSet:
-                        glyphSet[glyphIdx] = len(glyphMap)
-                        glyphMap.append(glyphIdx)
-                    if flags & GF_ARG_1_AND_2_ARE_WORDS:
-                        self.skip(4)
-                    else:
-                        self.skip(2)
-                    if flags & GF_WE_HAVE_A_SCALE:
-                        self.skip(2)
-                    elif flags & GF_WE_HAVE_AN_X_AND_Y_SCALE:
-                        self.skip(4)
-                    elif flags & GF_WE_HAVE_A_TWO_BY_TWO:
-                        self.skip(8)
-
 
         # The following tables are simply copied from the original
         for tag in ('name', 'OS/2', 'cvt ', 'fpgm', 'prep'):
             try:
-                output.add(tag, self.get_table(tag))
+                output.append((tag, self.get_table(tag)))
             except KeyError:
                 # Apparently some of the tables are optional (cvt, fpgm, prep).
                 # The lack of the required ones (name, OS/2) would have already
@@ -900,16 +1444,17 @@ class TTFontFile(TTFontParser):
 
         # post - PostScript
         post = b"\x00\x03\x00\x00" + self.get_table('post')[4:16] + b"\x00" * 16
-        output.add('post', post)
+        output.append(('post', post))
 
         numGlyphs = len(glyphMap)
 
         # hmtx - Horizontal Metrics
         hmtx = []
+        advanceWidths = self.advanceWidths
+        leftSideBearings = self.leftSideBearings
         for n in xrange(numGlyphs):
-            aw, lsb = self.hmetrics[glyphMap[n]]
-            hmtx.append(int(aw))
-            hmtx.append(int(lsb))
+            hmtx.append(advanceWidths[glyphMap[n]])
+            hmtx.append(leftSideBearings[glyphMap[n]])
 
         #work out n as 0 or first aw that's the start of a run
         n = len(hmtx)-2
@@ -920,91 +1465,50 @@ class TTFontFile(TTFontParser):
         hmtx = hmtx[:n] + hmtx[n+1::2]  #full pairs + all the trailing lsb's
 
         hmtx = pack(*([">%dH" % len(hmtx)] + hmtx))
-        output.add('hmtx', hmtx)
+        output.append(('hmtx', hmtx))
 
         # hhea - Horizontal Header
         hhea = self.get_table('hhea')
         hhea = _set_ushort(hhea, 34, numberOfHMetrics)
-        output.add('hhea', hhea)
+        output.append(('hhea', hhea))
 
         # maxp - Maximum Profile
         maxp = self.get_table('maxp')
         maxp = _set_ushort(maxp, 4, numGlyphs)
-        output.add('maxp', maxp)
-
-        # cmap - Character to glyph mapping
-        # XXX maybe use format 0 if possible, not 6?
-        entryCount = len(subset)
-        length = 10 + entryCount * 2
-        cmap = [0, 1,           # version, number of tables
-                1, 0, 0,12,     # platform, encoding, offset (hi,lo)
-                6, length, 0,   # format, length, language
-                0,
-                entryCount] + \
-               list(map(codeToGlyph.get, subset))
-        cmap = pack(*([">%dH" % len(cmap)] + cmap))
-        output.add('cmap', cmap)
+        output.append(('maxp', maxp))
 
         # glyf - Glyph data
-        glyphData = self.get_table('glyf')
-        offsets = []
-        glyf = []
+        # Every glyph starts on a 4 byte boundary; the offsets are worked out
+        # first so the glyphs can be copied into one preallocated buffer and
+        # the references in composite glyphs fixed in place.
+        offsets = array(_UINT32, [0])
         pos = 0
-        for n in xrange(numGlyphs):
+        for data, components in records:
+            pos += (len(data)+3)&~3
             offsets.append(pos)
-            originalGlyphIdx = glyphMap[n]
-            glyphPos = self.glyphPos[originalGlyphIdx]
-            glyphLen = self.glyphPos[originalGlyphIdx + 1] - glyphPos
-            data = glyphData[glyphPos:glyphPos+glyphLen]
-            # Fix references in composite glyphs
-            if glyphLen > 2 and unpack(">h", data[:2])[0] < 0:
-                # composite glyph
-                pos_in_glyph = 10
-                flags = GF_MORE_COMPONENTS
-                while flags & GF_MORE_COMPONENTS:
-                    flags = unpack(">H", data[pos_in_glyph:pos_in_glyph+2])[0]
-                    glyphIdx = unpack(">H", data[pos_in_glyph+2:pos_in_glyph+4])[0]
-                    data = _set_ushort(data, pos_in_glyph + 2, glyphSet[glyphIdx])
-                    pos_in_glyph = pos_in_glyph + 4
-                    if flags & GF_ARG_1_AND_2_ARE_WORDS:
-                        pos_in_glyph = pos_in_glyph + 4
-                    else:
-                        pos_in_glyph = pos_in_glyph + 2
-                    if flags & GF_WE_HAVE_A_SCALE:
-                        pos_in_glyph = pos_in_glyph + 2
-                    elif flags & GF_WE_HAVE_AN_X_AND_Y_SCALE:
-                        pos_in_glyph = pos_in_glyph + 4
-                    elif flags & GF_WE_HAVE_A_TWO_BY_TWO:
-                        pos_in_glyph = pos_in_glyph + 8
-            glyf.append(data)
-            pos = pos + glyphLen
-            if pos % 4 != 0:
-                padding = 4 - pos % 4
-                glyf.append(b'\0' * padding)
-                pos = pos + padding
-        offsets.append(pos)
-        output.add('glyf', b''.join(glyf))
+        glyf = bytearray(pos)
+        for n, (data, components) in enumerate(records):
+            pos = offsets[n]
+            glyf[pos:pos+len(data)] = data
+            for pos_in_glyph, glyphIdx in components:
+                pack_into(">H", glyf, pos + pos_in_glyph, glyphSet[glyphIdx])
+        output.append(('glyf', glyf))
 
         # loca - Index to location
-        loca = []
-        if (pos + 1) >> 1 > 0xFFFF:
+        if (offsets[-1] + 1) >> 1 > 0xFFFF:
             indexToLocFormat = 1        # long format
-            for offset in offsets:
-                loca.append(offset)
-            loca = pack(*([">%dL" % len(loca)] + loca))
+            loca = offsets
         else:
             indexToLocFormat = 0        # short format
-            for offset in offsets:
-                loca.append(offset >> 1)
-            loca = pack(*([">%dH" % len(loca)] + loca))
-        output.add('loca', loca)
+            loca = array('H', [offset >> 1 for offset in offsets])
+        output.append(('loca', _arrayToBigEndian(loca)))
 
         # head - Font header
         head = self.get_table('head')
         head = _set_ushort(head, 50, indexToLocFormat)
-        output.add('head', head)
+        output.append(('head', head))
 
-        return output.makeStream()
+        return output, glyphSet
 
 
 #
@@ -1028,10 +1532,10 @@ class TTFontFace(TTFontFile, pdfmetrics.TypeFace):
     Conceptually similar to a single byte typeface, but the glyphs are
     identified by UCS character codes instead of glyph names."""
 
-    def __init__(self, filename, validate=0, subfontIndex=0):
+    def __init__(self, filename, validate=0, subfontIndex=0, useMmap=None):
         "Loads a TrueType font from filename."
         pdfmetrics.TypeFace.__init__(self, None)
-        TTFontFile.__init__(self, filename, validate=validate, subfontIndex=subfontIndex)
+        TTFontFile.__init__(self, filename, validate=validate, subfontIndex=subfontIndex, useMmap=useMmap)
 
     def getCharWidth(self, code):
         "Returns the width of character U+<code>"
@@ -1093,12 +1597,20 @@ class TTFont:
     """
     class State:
         namePrefix = 'F'
-        def __init__(self,asciiReadable=None):
+        def __init__(self,asciiReadable=None,embedCID=0):
             self.assignments = {}
             self.nextCode = 0
             self.internalName = None
             self.frozen = 0
 
+            if embedCID:
+                # a single subset; CID n+1 is the glyph of subsets[0][n] and
+                # glyphs maps original glyph indexes to their CIDs
+                self.subsets = [[]]
+                self.glyphs = {}
+                self.nextCode = 1
+                return
+
             if asciiReadable is None:
                 asciiReadable = rl_config.ttfAsciiReadable
 
@@ -1118,23 +1630,37 @@ class TTFont:
     _multiByte = 1      # We want our own stringwidth
     _dynamicFont = 1    # We want dynamic subsetting
 
-    def __init__(self, name, filename, validate=0, subfontIndex=0,asciiReadable=None):
+    def __init__(self, name, filename, validate=0, subfontIndex=0,asciiReadable=None,useMmap=None,embedCID=None):
         """Loads a TrueType font from filename.
 
         If validate is set to a false values, skips checksum validation.  This
-        can save time, especially if the font is large.
+        can save time, especially if the font is large.  If useMmap is set the
+        font file is memory mapped rather than read into memory.  If embedCID
+        is set the font is written as one Type0 font with Identity-H encoding
+        holding every used glyph, instead of a TrueType font per 256 characters.
         """
         self.fontName = name
-        self.face = TTFontFace(filename, validate=validate, subfontIndex=subfontIndex)
+        self.face = TTFontFace(filename, validate=validate, subfontIndex=subfontIndex, useMmap=useMmap)
         self.encoding = TTEncoding()
         from weakref import WeakKeyDictionary
         self.state = WeakKeyDictionary()
         if asciiReadable is None:
             asciiReadable = rl_config.ttfAsciiReadable
         self._asciiReadable = asciiReadable
+        if embedCID is None:
+            embedCID = rl_config.ttfEmbedCID
+        self._embedCID = embedCID
 
     def stringWidth(self,text,size,encoding='utf8'):
-        return instanceStringWidthTTF(self,text,size,encoding)
+        charWidths = self.face.charWidths
+        if isinstance(charWidths, dict):
+            return instanceStringWidthTTF(self,text,size,encoding)
+        # the accelerated version only knows dicts
+        if not isUnicode(text):
+            text = text.decode(encoding or 'utf-8')
+        g = charWidths.get
+        dw = self.face.defaultWidth
+        return 0.001*size*sum([g(ord(u),dw) for u in text])
 
     def _assignState(self,doc,asciiReadable=None,namePrefix=None):
         '''convenience function for those wishing to roll their own state properties'''
@@ -1143,7 +1669,7 @@ class TTFont:
         try:
             state = self.state[doc]
         except KeyError:
-            state = self.state[doc] = TTFont.State(asciiReadable)
+            state = self.state[doc] = TTFont.State(asciiReadable,self._embedCID)
             if namePrefix is not None:
                 state.namePrefix = namePrefix
         return state
@@ -1155,7 +1681,9 @@ class TTFont:
         subsets when building different documents at the same time."""
         asciiReadable = self._asciiReadable
         try: state = self.state[doc]
-        except KeyError: state = self.state[doc] = TTFont.State(asciiReadable)
+        except KeyError: state = self.state[doc] = TTFont.State(asciiReadable,self._embedCID)
+        if self._embedCID:
+            return self._splitStringCID(text, state)
         curSet = -1
         cur = []
         results = []
@@ -1192,12 +1720,47 @@ class TTFont:
             results.append((curSet,bytes(cur) if isPy3 else ''.join(chr(c) for c in cur)))
         return results
 
+    def _splitStringCID(self, text, state):
+        """splitString for CID mode.  Every glyph gets the next free CID the
+        first time it is used and the text is returned as a single chunk of
+        big endian 2 byte CIDs.  Characters the font lacks all share CID 0."""
+        if not isUnicode(text):
+            text = text.decode('utf-8')
+        assignments = state.assignments
+        glyphs = state.glyphs
+        subset = state.subsets[0]
+        charToGlyph = self.face.charToGlyph
+        cids = array('H')
+        for code in map(ord,text):
+            n = assignments.get(code)
+            if n is None:
+                if state.frozen:
+                    raise pdfdoc.PDFError("Font %s is already frozen, cannot add new character U+%04X" % (self.fontName, code))
+                glyph = charToGlyph.get(code, 0)
+                if not glyph:
+                    n = 0
+                elif glyph in glyphs:
+                    n = glyphs[glyph]
+                else:
+                    if state.nextCode > 0xFFFF:
+                        raise pdfdoc.PDFError("Font %s has run out of CIDs" % self.fontName)
+                    n = glyphs[glyph] = state.nextCode
+                    state.nextCode += 1
+                    subset.append(code)
+                assignments[code] = n
+            cids.append(n)
+        if not cids:
+            return []
+        if sys.byteorder == 'little':
+            cids.byteswap()
+        return [(0, cids.tobytes() if isPy3 else cids.tostring())]
+
     def getSubsetInternalName(self, subset, doc):
         """Returns the name of a PDF Font object corresponding to a given
         subset of this dynamic font.  Use this function instead of
         PDFDocument.getInternalFontName."""
         try: state = self.state[doc]
-        except KeyError: state = self.state[doc] = TTFont.State(self._asciiReadable)
+        except KeyError: state = self.state[doc] = TTFont.State(self._asciiReadable,self._embedCID)
         if subset < 0 or subset >= len(state.subsets):
             raise IndexError('Subset %d does not exist in font %s' % (subset, self.fontName))
         if state.internalName is None:
@@ -1215,8 +1778,12 @@ class TTFont:
         FontDescriptor is a (no more than) 256 character subset of the original
         TrueType font."""
         try: state = self.state[doc]
-        except KeyError: state = self.state[doc] = TTFont.State(self._asciiReadable)
+        except KeyError: state = self.state[doc] = TTFont.State(self._asciiReadable,self._embedCID)
         state.frozen = 1
+        if self._embedCID:
+            self._addCIDObjects(doc, state)
+            del self.state[doc]
+            return
         for n,subset in enumerate(state.subsets):
             internalName = self.getSubsetInternalName(n, doc)[1:]
             baseFontName = (b''.join((SUBSETN(n),b'+',self.face.name,self.face.subfontNameX))).decode('pdfdoc')
@@ -1245,3 +1812,51 @@ class TTFont:
             fontDict = doc.idToObject['BasicFonts'].dict
             fontDict[internalName] = pdfFont
         del self.state[doc]
+
+    def _addCIDObjects(self, doc, state):
+        """Writes the single subset of CID mode as a Type0 font with a
+        CIDFontType2 descendant.  The subset numbers its glyphs in font
+        order rather than CID order, so unless the two agree a CIDToGIDMap
+        stream maps every CID to its glyph."""
+        subset = state.subsets[0]
+        internalName = self.getSubsetInternalName(0, doc)[1:]
+        baseFontName = (b''.join((SUBSETN(0),b'+',self.face.name,self.face.subfontNameX))).decode('pdfdoc')
+
+        cidFont = pdfdoc.PDFCIDFontType2()
+        cidFont.__Comment__ = 'CID font %s' % self.fontName
+        cidFont.BaseFont = baseFontName
+        cidFont.CIDSystemInfo = pdfdoc.PDFDictionary({
+            'Registry': pdfdoc.PDFString('Adobe'),
+            'Ordering': pdfdoc.PDFString('Identity'),
+            'Supplement': 0,
+            })
+        gids = [0] + self.face.getSubsetGlyphs(subset)
+        if gids == list(range(len(gids))):
+            cidFont.CIDToGIDMap = pdfdoc.PDFName('Identity')
+        else:
+            cidToGIDStream = pdfdoc.PDFStream()
+            cidToGIDStream.content = pack(*([">%dH" % len(gids)] + gids))
+            if doc.compression:
+                cidToGIDStream.filters = [pdfdoc.PDFZCompress]
+            cidFont.CIDToGIDMap = doc.Reference(cidToGIDStream, 'cidToGIDMap:' + baseFontName)
+        cidFont.DW = self.face.defaultWidth
+        cidFont.W = pdfdoc.PDFArray(makeCIDWidths(list(map(self.face.getCharWidth, subset))))
+        cidFont.FontDescriptor = self.face.addSubsetObjects(doc, baseFontName, subset)
+
+        pdfFont = pdfdoc.PDFType0Font()
+        pdfFont.__Comment__ = 'Font %s' % self.fontName
+        pdfFont.Name = internalName
+        pdfFont.BaseFont = baseFontName
+        pdfFont.Encoding = pdfdoc.PDFName('Identity-H')
+        pdfFont.DescendantFonts = pdfdoc.PDFArray([doc.Reference(cidFont, 'cidFont:' + baseFontName)])
+
+        cmapStream = pdfdoc.PDFStream()
+        cmapStream.content = makeToUnicodeCIDCMap(baseFontName, subset)
+        if doc.compression:
+            cmapStream.filters = [pdfdoc.PDFZCompress]
+        pdfFont.ToUnicode = doc.Reference(cmapStream, 'toUnicodeCMap:' + baseFontName)
+
+        # link it in
+        ref = doc.Reference(pdfFont, internalName)
+        fontDict = doc.idToObject['BasicFonts'].dict
+        fontDict[internalName] = pdfFont
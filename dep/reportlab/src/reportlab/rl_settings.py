@@ -40,6 +40,12 @@ paraFontSizeHeightOffset
 canvas_baseColor
 ignoreContainerActions
 ttfAsciiReadable
+ttfUseMmap
+ttfIndexDir
+ttfLazyCharInfo
+ttfGlyphCacheSize
+ttfSubsetCacheSize
+ttfEmbedCID
 pdfMultiLine
 pdfComments
 debug
@@ -95,6 +101,12 @@ paraFontSizeHeightOffset=   1                       #if true paragraphs start at
 canvas_baseColor=           None                    #initialize the canvas fill and stroke colors if this is set
 ignoreContainerActions=     1                       #if true then action flowables in flowable _Containers will be ignored
 ttfAsciiReadable=           1                       #smaller subsets when set to 0
+ttfUseMmap=                 0                       #if 1 TrueType font files are memory mapped rather than read into memory
+ttfIndexDir=                None                    #if not None parsed TrueType fonts are indexed in this directory ('' means next to the font)
+ttfLazyCharInfo=            0                       #if 1 TrueType glyphs and metrics are only read for the characters used
+ttfGlyphCacheSize=          2048                    #number of glyph records each TrueType font keeps for subsetting
+ttfSubsetCacheSize=         16                      #number of finished subsets each TrueType font keeps for later documents
+ttfEmbedCID=                0                       #1 means embed TrueType fonts as a single Identity-H CID font subset
 pdfMultiLine=               0                       #use more lines in pdf etc
 pdfComments=                0                       #put in pdf comments
 debug=                      0                       #for debugging code
@@ -12,10 +12,10 @@ from reportlab.pdfgen.canvas import Canvas
 from reportlab.pdfbase import pdfmetrics
 from reportlab.pdfbase.pdfdoc import PDFDocument, PDFError
 from reportlab.pdfbase.ttfonts import TTFont, TTFontFace, TTFontFile, TTFOpenFile, \
-                                      TTFontParser, TTFontMaker, TTFError, \
-                                      makeToUnicodeCMap, \
+                                      TTFontParser, TTFontMaker, TTFError, GlyphTable, LazyGlyphTable, \
+                                      makeToUnicodeCMap, makeCIDWidths, \
                                       FF_SYMBOLIC, FF_NONSYMBOLIC, \
-                                      calcChecksum, add32
+                                      calcChecksum, _calcChecksum, add32
 from reportlab import rl_config
 from reportlab.lib.utils import getBytesIO, isPy3, uniChr, int2Byte
 
@@ -134,6 +134,9 @@ class TTFontFileTestCase(NearTestCase):
         self.assertEquals(calcChecksum(b"\xD1\x02\x03\x04\x40\x20\x30\x40"), 0x11223344)
         self.assertEquals(calcChecksum(b"\x81\x02\x03\x04\x90\x20\x30\x40"), 0x11223344)
         self.assertEquals(calcChecksum(b"\x7F\xFF\xFF\xFF\x00\x00\x00\x01"), 0x80000000)
+        data = b"\x01\x02\x03\x04\x10\x20\x30\x40"
+        self.assertEquals(_calcChecksum(bytearray(data)), 0x11223344)
+        self.assertEquals(_calcChecksum(memoryview(data)[4:]), 0x10203040)
 
     def testFontFileChecksum(self):
         "Tests TTFontFile and TTF parsing code"
@@ -167,6 +170,137 @@ class TTFontFileTestCase(NearTestCase):
         self.assertNear(subset.bbox, [-183.10546875, -235.83984375, 1287.109375, 928.22265625])
         self.assertEquals(subset.stemV, 87)
 
+    def testMmap(self):
+        "Tests TTFontFile parsing a memory mapped file"
+        ttf = TTFontFile("Vera.ttf", validate=1)
+        mttf = TTFontFile("Vera.ttf", validate=1, useMmap=1)
+        if isPy3:
+            self.assertTrue(isinstance(mttf._ttf_data, memoryview))
+        self.assertEquals(mttf.name, ttf.name)
+        self.assertEquals(mttf.charWidths, ttf.charWidths)
+        self.assertEquals(bytes(mttf.get_table('name')), ttf.get_table('name'))
+        subset = [0x41, 0x42, 0xC5, 0x2017]
+        self.assertEquals(mttf.makeSubset(subset), ttf.makeSubset(subset))
+
+    def testIndex(self):
+        "Tests the compiled index of TTFontFile"
+        import tempfile, shutil, os
+        indexDir = tempfile.mkdtemp()
+        ttfIndexDir = rl_config.ttfIndexDir
+        try:
+            rl_config.ttfIndexDir = indexDir
+            ttf = TTFontFile("Vera.ttf")
+            self.assertTrue(os.path.isfile(ttf.getIndexFilename()))
+            self.assertTrue(ttf.loadIndex())
+            self.assertFalse(ttf.loadIndex(charInfo=0))
+            ittf = TTFontFile("Vera.ttf")
+            for attr in TTFontFile._indexAttrs:
+                self.assertEquals(getattr(ittf, attr), getattr(ttf, attr))
+            subset = [0x41, 0x42, 0xC5, 0x2017]
+            self.assertEquals(ittf.makeSubset(subset), ttf.makeSubset(subset))
+        finally:
+            rl_config.ttfIndexDir = ttfIndexDir
+            shutil.rmtree(indexDir)
+
+    def testGlyphTable(self):
+        "Tests GlyphTable"
+        D = {0x20: 3, 0x41: 36, 0x4E00: 0, 0x4E01: 0xFFFF, 0x1F600: 70000}
+        T = GlyphTable(D)
+        self.assertEquals(len(T), len(D))
+        self.assertEquals(list(T), sorted(D))
+        self.assertEquals(T, D)
+        self.assertEquals(T.get(0x4E00, 5), 0)
+        self.assertEquals(T.get(0x4E02, 5), 5)
+        self.assertEquals(T.get(0x110000), None)
+        self.assertTrue(0x1F600 in T)
+        self.assertFalse(0x21 in T)
+        self.assertRaises(KeyError, T.__getitem__, 0x21)
+
+    def testLazyCharInfo(self):
+        "Tests TTFontFile with lazyCharInfo"
+        ttf = TTFontFile("Vera.ttf")
+        lttf = TTFontFile("Vera.ttf", lazyCharInfo=1)
+        self.assertTrue(isinstance(lttf.charToGlyph, LazyGlyphTable))
+        for code in list(ttf.charToGlyph) + [0x3000, 0xFFFF, 0x10FFFF]:
+            self.assertEquals(lttf.charToGlyph.get(code), ttf.charToGlyph.get(code))
+            self.assertEquals(lttf.charWidths.get(code), ttf.charWidths.get(code))
+        self.assertEquals(lttf.defaultWidth, ttf.defaultWidth)
+        self.assertEquals(list(lttf.hmetrics), list(ttf.hmetrics))
+        self.assertEquals(list(lttf.glyphPos), list(ttf.glyphPos))
+        self.assertEquals(lttf.charToGlyph, ttf.charToGlyph)
+        subset = [0x41, 0x42, 0xC5, 0x2017]
+        self.assertEquals(lttf.makeSubset(subset), ttf.makeSubset(subset))
+
+        from struct import pack
+        class FakeTTFontFile(TTFontParser):
+            _decodeCmap = TTFontFile.__dict__['_decodeCmap']
+            def __init__(self, data):
+                self._ttf_data = data
+                self._pos = 0
+        groups = [(0x20, 0x7E, 1), (0x4E00, 0x4E05, 200), (0x20000, 0x20001, 300)]
+        data = pack('>HHLLL', 12, 0, 16 + 12*len(groups), 0, len(groups))
+        data += b''.join(pack('>LLL', *group) for group in groups)
+        ttf = FakeTTFontFile(data)
+        T = LazyGlyphTable(ttf, 0, 0)
+        self.assertEquals(T.get(0x20), 1)
+        self.assertEquals(T.get(0x7E), 0x5F)
+        self.assertEquals(T.get(0x4E03), 203)
+        self.assertEquals(T.get(0x20001), 301)
+        self.assertEquals(T.get(0x7F), None)
+        self.assertEquals(T.get(0x30000), None)
+        self.assertEquals(T, ttf._decodeCmap(0, 0))
+
+    def testDecodeCmap4(self):
+        "Tests decoding of cmap format 4 segments"
+        from struct import pack
+        class FakeTTFontFile(TTFontParser):
+            _decodeCmap = TTFontFile.__dict__['_decodeCmap']
+            def __init__(self, data):
+                self._ttf_data = data
+                self._pos = 0
+        # (start, end, idDelta, idRangeOffset); the second segment indexes
+        # glyphIdArray but has one entry fewer than characters, the third
+        # wraps around 65536
+        segments = [(0x41, 0x43, -0x40, 0), (0x61, 0x64, 5, 6), (0xFFF0, 0xFFF2, 0x0F, 0), (0xFFFF, 0xFFFF, 1, 0)]
+        glyphIdArray = [10, 0, 20]
+        n = len(segments)
+        data = pack('>7H', 4, 16 + 8*n + 2*len(glyphIdArray), 0, 2*n, 0, 0, 0)
+        data += pack('>%dH' % n, *[seg[1] for seg in segments]) + b'\0\0'
+        data += pack('>%dH' % n, *[seg[0] for seg in segments])
+        data += pack('>%dh' % n, *[seg[2] for seg in segments])
+        data += pack('>%dH' % n, *[seg[3] for seg in segments])
+        data += pack('>%dH' % len(glyphIdArray), *glyphIdArray)
+        self.assertEquals(FakeTTFontFile(data)._decodeCmap(0, 0),
+                          {0x41: 1, 0x42: 2, 0x43: 3, 0x61: 15, 0x62: 0, 0x63: 25, 0x64: 0,
+                           0xFFF0: 0xFFFF, 0xFFF1: 0, 0xFFF2: 1, 0xFFFF: 0})
+
+    def testSubsetCache(self):
+        "Tests the glyph and subset caches of TTFontFile"
+        ttf = TTFontFile("Vera.ttf")
+        data, components = ttf.getGlyphRecord(ttf.charToGlyph[0xC0])
+        self.assertEquals([glyph for pos, glyph in components], [36, 262])
+        self.assertTrue(ttf.getGlyphRecord(ttf.charToGlyph[0xC0]) is ttf.getGlyphRecord(ttf.charToGlyph[0xC0]))
+        subset = [0x41, 0xBC, 0xC0, 0x2017]
+        stream = ttf.makeSubset(subset)
+        self.assertEquals(ttf.makeSubset(list(subset)), stream)
+        self.assertEquals(TTFontFile("Vera.ttf").makeSubset(subset), stream)
+        sttf = TTFontFile(getBytesIO(stream))
+        self.assertEquals(sttf.numGlyphs, 8)    # .notdef, 3 characters (Vera has no U+2017) and 4 components
+        # the same characters in another order share the tables, only the cmap differs
+        tables = ttf._getSubsetTables(subset)
+        reordered = [0xC0, 0x2017, 0x41, 0xBC]
+        self.assertTrue(ttf._getSubsetTables(reordered) is tables)
+        rstream = ttf.makeSubset(reordered)
+        rttf = TTFontFile(getBytesIO(rstream))
+        for tag in ('glyf', 'loca', 'hmtx'):
+            self.assertEquals(rttf.get_table(tag), sttf.get_table(tag))
+        self.assertNotEquals(rttf.get_table('cmap'), sttf.get_table('cmap'))
+        glyphs = ttf.getSubsetGlyphs(subset)
+        self.assertEquals(ttf.getSubsetGlyphs(reordered), [glyphs[2], glyphs[3], glyphs[0], glyphs[1]])
+        self.assertEquals(glyphs[3], 0)
+        self.assertEquals([sttf.advanceWidths[glyph] for glyph in glyphs[:3]],
+                          [ttf.advanceWidths[ttf.charToGlyph[code]] for code in subset[:3]])
+
     def testFontMaker(self):
         "Tests TTFontMaker class"
         ttf = TTFontMaker()
@@ -174,6 +308,8 @@ class TTFontFileTestCase(NearTestCase):
         ttf.add("QUUX", b"123")
         ttf.add("head", b"12345678xxxx")
         stm = ttf.makeStream()
+        # the checksum of the whole file must come out as the magic number
+        self.assertEquals(calcChecksum(stm), 0xB1B0AFBA)
         ttf = TTFontParser(getBytesIO(stm), 0)
         self.assertEquals(ttf.get_table("ABCD"), b"xyzzy")
         self.assertEquals(ttf.get_table("QUUX"), b"123")
@@ -259,6 +395,46 @@ class TTFontTestCase(NearTestCase):
         self.assertEquals(font.getSubsetInternalName(2, doc), "/F1+2")
         self.assertEquals(doc.delayedFonts, [font])
 
+    def testSplitStringCID(self):
+        "Tests TTFont.splitString in CID mode"
+        doc = PDFDocument()
+        font = TTFont("Vera", "Vera.ttf", embedCID=1)
+        # characters Vera lacks all become CID 0
+        self.assertEquals(font.splitString(u'AB\u00c5A\u4e2d\u2015', doc),
+                          [(0, b'\x00\x01\x00\x02\x00\x03\x00\x01\x00\x00\x00\x00')])
+        self.assertEquals(font.state[doc].subsets, [[0x41, 0x42, 0xC5]])
+        self.assertEquals(font.splitString(u'', doc), [])
+        self.assertEquals(font.getSubsetInternalName(0, doc), "/F1+0")
+        self.assertRaises(IndexError, font.getSubsetInternalName, 1, doc)
+
+    def testAddObjectsCID(self):
+        "Test TTFont.addObjects in CID mode"
+        doc = PDFDocument()
+        font = TTFont("Vera", "Vera.ttf", embedCID=1)
+        text = u''.join(uniChr(i) for i in range(32, 600))
+        font.splitString(text, doc)
+        subset = font.state[doc].subsets[0]
+        font.addObjects(doc)
+        pdfFont = doc.idToObject['BasicFonts'].dict['F1+0']
+        self.assertEquals(pdfFont.Subtype, 'Type0')
+        self.assertEquals(pdfFont.Encoding, '/Identity-H')
+        cidFont = doc.idToObject[pdfFont.DescendantFonts.sequence[0].name]
+        self.assertEquals(cidFont.Subtype, 'CIDFontType2')
+        fontFile = doc.idToObject['fontFile:%s(%s)' % (font.face.filename, cidFont.BaseFont)]
+        # the CIDToGIDMap maps CID n to its glyph in the embedded subset
+        from struct import unpack
+        sttf = TTFontFile(getBytesIO(fontFile.content))
+        cidToGID = doc.idToObject['cidToGIDMap:' + cidFont.BaseFont].content
+        gids = unpack('>%dH' % (len(cidToGID) // 2), cidToGID)
+        self.assertEquals(len(gids), len(subset) + 1)
+        self.assertEquals([sttf.advanceWidths[gid] for gid in gids[1:]],
+                          [font.face.advanceWidths[font.face.charToGlyph[code]] for code in subset])
+        toUnicode = doc.idToObject['toUnicodeCMap:' + cidFont.BaseFont].content
+        self.assert_('<0001> <0020>' in toUnicode)
+        W = makeCIDWidths([500, 500, 500, 600, 700, 700])
+        self.assertEquals(W[:4] + W[5:], [1, 3, 500, 4, 5, 6, 700])
+        self.assertEquals(W[4].sequence, [600])
+
     def testAddObjectsEmpty(self):
         "TTFont.addObjects should not fail when no characters were used"
         font = TTFont("Vera", "Vera.ttf")
@@ -3,9 +3,14 @@ Constants which will be used in the main logic.
 """
 VERSION = 'v2.2.2'
 LETTER_FORMAT_PATH = 'res/tw_lal.pdf'
-GENERATED_TEXT_PATH = 'content.pdf'
-GENERATED_BLANK_LETTER_PATH = 'blank_letter.pdf'
 DEFAULT_FONT_PATH = 'res/TW-Kai-98_1.ttf'
+# embedded: the text is drawn with the TrueType font, whose subset is embedded
+# standard: the text is drawn with a standard CJK font that PDF viewers
+#           provide themselves; nothing is embedded, for on-screen review
+FONT_MODE_EMBEDDED = 'embedded'
+FONT_MODE_STANDARD = 'standard'
+FONT_MODES = (FONT_MODE_EMBEDDED, FONT_MODE_STANDARD)
+STANDARD_FONT_NAME = 'MSung-Light'
 _PDF_INCH = 72
 ########################################################################
 # pre-defined coordinates of main article
@@ -1,10 +1,12 @@
 """
 Core functions
 """
-from os import remove
+from . import fontregistry
+from . import layout
 from . import pdfpage
-from . import pdfpainter
+from . import rendercontext
 from .constants import *
+from .fontregistry import MissingGlyphError
 
 def read_main_article(filepath):
     codec_name = 'utf-8'
@@ -23,49 +25,77 @@ def read_main_article(filepath):
     text = text.lstrip(bom)
     return text
 
-def merge_text_and_letter(output_filename):
-    print('Merging...')
-    page_merge = pdfpage.PDFPageMerge(GENERATED_TEXT_PATH,
-                                      GENERATED_BLANK_LETTER_PATH,
-                                      output_filename)
-    for i in range(page_merge.get_src_total_page()):
-        page_merge.merge_src_page_to_dest_page(i, i)
-    page_merge.save()
-
-def clean_temp_files():
-    remove(GENERATED_TEXT_PATH)
-    remove(GENERATED_BLANK_LETTER_PATH)
-
-def generate_text_and_letter(senders, senders_addr,
-                             receivers, receivers_addr,
-                             ccs, cc_addr,
-                             main_text):
-    generator = pdfpainter.PDFPainter(GENERATED_TEXT_PATH,
-                                      LETTER_FORMAT_WIDE_HEIGHT[0], LETTER_FORMAT_WIDE_HEIGHT[1])
-    blank_letter_producer = pdfpage.PDFPagePick(LETTER_FORMAT_PATH, GENERATED_BLANK_LETTER_PATH)
+def preload_resources():
+    """
+    Parse the letter template and the default font in advance,
+    so that the first letter does not have to pay for it.
+    """
+    pdfpage.get_letter_template(LETTER_FORMAT_PATH)
+    fontregistry.get_font_name(DEFAULT_FONT_PATH)
+
+def generate_letter(senders, senders_addr,
+                    receivers, receivers_addr,
+                    ccs, cc_addr,
+                    main_text, single_pass=True, font_mode=FONT_MODE_EMBEDDED):
+    """
+    Generate the whole letter in memory and return the PDF as bytes.
+    No intermediate file is written and no state is shared with other
+    letters being generated at the same time.
+    With single_pass the letter form is drawn together with the text,
+    otherwise the text is stamped onto the form afterwards.
+    font_mode is one of FONT_MODES; FONT_MODE_STANDARD gives a small file
+    for on-screen review that does not embed the font.
+    Raises MissingGlyphError, before anything is rendered, if neither the
+    font nor a fallback font has some of the characters.
+    """
+    if font_mode not in FONT_MODES:
+        raise ValueError('Unknown font mode: %s' % font_mode)
+    if font_mode == FONT_MODE_EMBEDDED:
+        missing = find_missing_characters(senders, senders_addr,
+                                          receivers, receivers_addr,
+                                          ccs, cc_addr,
+                                          main_text)
+        if missing:
+            raise MissingGlyphError(missing)
+    context = rendercontext.RenderContext(single_pass=single_pass, font_mode=font_mode)
+    painter = context.painter
 
     # write name and address directly if one page is enough
     one_page_is_enough = _is_only_one_name_or_address(senders, senders_addr) and \
                       _is_only_one_name_or_address(receivers, receivers_addr) and \
                       _is_only_one_name_or_address(ccs, cc_addr)
     if one_page_is_enough:
-        generator.set_font(DEFAULT_FONT_PATH, 10)
-        _fill_name_address_on_1st_page(generator, senders, senders_addr, 's')
-        _fill_name_address_on_1st_page(generator, receivers, receivers_addr, 'r')
-        _fill_name_address_on_1st_page(generator, ccs, cc_addr, 'c')
+        context.set_font_size(10)
+        _fill_name_address_on_1st_page(painter, senders, senders_addr, 's')
+        _fill_name_address_on_1st_page(painter, receivers, receivers_addr, 'r')
+        _fill_name_address_on_1st_page(painter, ccs, cc_addr, 'c')
 
-    generator.set_font(DEFAULT_FONT_PATH, 20)
+    context.set_font_size(20)
     # 將寄件人、收件人等資訊傳給_parse_main_article函數
-    _parse_main_article(generator, blank_letter_producer, main_text,
+    _parse_main_article(context, main_text,
                        senders, senders_addr, receivers, receivers_addr, ccs, cc_addr)
 
     if one_page_is_enough is False:
-        _draw_info_box(generator, senders, senders_addr, receivers, receivers_addr, ccs, cc_addr)
-        generator.end_this_page()
-        blank_letter_producer.insert_blank_page()
-
-    blank_letter_producer.save()
-    generator.save()
+        context.begin_blank_page()
+        _draw_info_box(context, senders, senders_addr, receivers, receivers_addr, ccs, cc_addr)
+        context.end_blank_page()
+
+    return context.render()
+
+def find_missing_characters(*texts):
+    """
+    Returns the characters of texts, which may be nested in lists, that
+    neither the default font nor any fallback font has, as a string.
+    It only looks them up in the coverage bitmaps, nothing is rendered.
+    """
+    return fontregistry.get_font_chain(DEFAULT_FONT_PATH).find_missing(_iter_texts(texts))
+
+def _iter_texts(texts):
+    for text in texts:
+        if isinstance(text, str):
+            yield text
+        elif text:
+            yield from _iter_texts(text)
 
 def _is_only_one_name_or_address(namelist, addresslist):
     ret_value = True
@@ -86,69 +116,59 @@ def _fill_name_address_on_1st_page(painter, namelist, addresslist, type_):
                             ADDR_COORDINATE[type_+'_x_y_begin'][1],
                             addresslist[0])
 
-def _parse_main_article(painter, page_pick, main_text, senders=None, senders_addr=None, receivers=None, receivers_addr=None, ccs=None, cc_addr=None):
+def _parse_main_article(context, main_text, senders=None, senders_addr=None, receivers=None, receivers_addr=None, ccs=None, cc_addr=None):
     print('Parse main article...')
-    x_begin, y_begin, line_counter, char_counter = _reset_coordinates_and_counters()
-    for i in range(0, len(main_text)):
-        if main_text[i] == '\n' or (char_counter > CONTENT_MAX_CHARACTER_PER_LINE):
-            x_begin, y_begin = _get_new_line_coordinate(y_begin)
-            line_counter = line_counter + 1
-            char_counter = 1
-            if main_text[i] == '\n':
-                continue
-        if line_counter > CONTENT_MAX_LINE_PER_PAGE:
-            painter.end_this_page()
-            page_pick.pick_individual_pages([0])
-            x_begin, y_begin, line_counter, char_counter = _reset_coordinates_and_counters()
-            
+    painter = context.painter
+    plan = layout.layout_article(main_text)
+    for page_num, page in enumerate(plan.pages):
+        if page_num > 0:
+            context.end_letter_page()
+
             # 在新頁面添加寄件人、收件人等資訊
             if senders and senders_addr:
-                painter.set_font(DEFAULT_FONT_PATH, 10)
+                context.set_font_size(10)
                 _fill_name_address_on_1st_page(painter, senders, senders_addr, 's')
             if receivers and receivers_addr:
-                painter.set_font(DEFAULT_FONT_PATH, 10)
+                context.set_font_size(10)
                 _fill_name_address_on_1st_page(painter, receivers, receivers_addr, 'r')
             if ccs and cc_addr:
-                painter.set_font(DEFAULT_FONT_PATH, 10)
+                context.set_font_size(10)
                 _fill_name_address_on_1st_page(painter, ccs, cc_addr, 'c')
-            painter.set_font(DEFAULT_FONT_PATH, 20)  # 還原字體大小
-            
-        painter.draw_string(x_begin, y_begin, main_text[i])
-        x_begin += (CONTENT_X_Y_INTERVAL[0] - CONTENT_X_Y_FIX[0])
-        char_counter = char_counter + 1
-    painter.end_this_page()
-    page_pick.pick_individual_pages([0])
+            context.set_font_size(20)  # 還原字體大小
+
+        # each line is drawn as one text object
+        for row, column, line_text in page.get_lines():
+            x_begin, y_begin = _get_cell_coordinate(row, column)
+            painter.draw_grid_text(x_begin, y_begin, line_text,
+                                   CONTENT_X_Y_INTERVAL[0] - CONTENT_X_Y_FIX[0])
+    context.end_letter_page()
     
     # 最後一頁也添加寄件人、收件人等資訊
     if senders and senders_addr and receivers and receivers_addr and ccs and cc_addr:
-        x_begin, y_begin, line_counter, char_counter = _reset_coordinates_and_counters()
-        painter.set_font(DEFAULT_FONT_PATH, 10)
+        context.set_font_size(10)
         _fill_name_address_on_1st_page(painter, senders, senders_addr, 's')
         _fill_name_address_on_1st_page(painter, receivers, receivers_addr, 'r')
         _fill_name_address_on_1st_page(painter, ccs, cc_addr, 'c')
-        painter.end_this_page()
-        page_pick.pick_individual_pages([0])
+        context.end_letter_page()
 
-def _get_new_line_coordinate(current_y):
-    new_x = CONTENT_X_Y_BEGIN[0]
-    new_y = current_y - (CONTENT_X_Y_INTERVAL[1] + CONTENT_X_Y_FIX[1])
+def _get_cell_coordinate(row, column):
+    new_x = CONTENT_X_Y_BEGIN[0] + column * (CONTENT_X_Y_INTERVAL[0] - CONTENT_X_Y_FIX[0])
+    new_y = CONTENT_X_Y_BEGIN[1] - row * (CONTENT_X_Y_INTERVAL[1] + CONTENT_X_Y_FIX[1])
     return new_x, new_y
 
-def _reset_coordinates_and_counters():
-    return CONTENT_X_Y_BEGIN[0], CONTENT_X_Y_BEGIN[1], 1, 1
-
-def _draw_info_box(painter,
+def _draw_info_box(context,
                    sender_list, sender_addr_list,
                    receiver_list, receiver_addr_list,
                    cc_list, cc_addr_list):
-    painter.set_font(DEFAULT_FONT_PATH, 8)
+    painter = context.painter
+    context.set_font_size(8)
     painter.draw_string(CUT_INFO_X_Y[0], CUT_INFO_X_Y[1], u'[請自行剪下貼上]')
     painter.draw_line(BOX_UPPDERLEFT_X_Y[0], BOX_UPPDERLEFT_X_Y[1],
                       BOX_UPPDERRIGHT_X_Y[0], BOX_UPPDERRIGHT_X_Y[1])
     painter.draw_string(QUOTE_X_Y[0], QUOTE_X_Y[1],
                         u'（寄件人如為機關、團體、學校、公司、商號請加蓋單位圖章及法定代理人簽名或蓋章）')
     painter.draw_rect(RECT_X_Y_W_H[0], RECT_X_Y_W_H[1], RECT_X_Y_W_H[2], RECT_X_Y_W_H[3])
-    painter.set_font(DEFAULT_FONT_PATH, 10)
+    context.set_font_size(10)
     painter.draw_string(CHT_IN_RECT_X_Y[0], CHT_IN_RECT_X_Y[1], u'印')
 
     painter.draw_string(TITLE_START[0], TITLE_START[1], u'一、寄件人')
@@ -0,0 +1,195 @@
+"""
+Process-wide registry of parsed TrueType fonts.
+Each (font path, subfont index) is parsed only once and then shared by
+every PDFPainter, across documents and requests. Standard CJK fonts are
+registered by name only, since they are neither parsed nor embedded.
+Every TrueType font gets a FontCoverage when it is registered, so
+characters it lacks can be found, or drawn with a fallback font, before
+anything is rendered.
+"""
+import os
+import threading
+from reportlab.pdfbase.ttfonts import TTFont
+from reportlab.pdfbase.cidfonts import UnicodeCIDFont
+from reportlab.pdfbase import pdfmetrics
+
+_FONT_NAME_PREFIX = 'user-sepecified-font'
+# reportlab pairs MSung-Light with the Simplified Chinese (GB) CMap, which
+# does not match its CNS1 glyph collection
+_TRADITIONAL_CHINESE_ENCODING = 'UniCNS-UCS2-H'
+# fonts tried in order for the characters the main font lacks, separated by os.pathsep
+_FALLBACK_FONT_PATHS = tuple(path for path in os.getenv('FALLBACK_FONT_PATHS', '').split(os.pathsep)
+                             if path)
+
+class MissingGlyphError(ValueError):
+    """
+    class MissingGlyphError
+    Raised before rendering when neither the font nor any fallback font has
+    a glyph for some characters. characters is a string of them, sorted.
+    """
+    def __init__(self, characters):
+        super().__init__(characters)
+        self.characters = characters
+
+    def __str__(self):
+        return 'No glyph for: ' + ' '.join('%s (U+%04X)' % (char, ord(char))
+                                           for char in self.characters)
+
+class FontCoverage:
+    """
+    class FontCoverage
+    Tells whether a font has a glyph for a codepoint. The glyph table is
+    only looked up for the codepoints asked for, so a font whose table is
+    read lazily does not have to decode all of it.
+    """
+    __slots__ = ('__char_to_glyph',)
+
+    def __init__(self, char_to_glyph):
+        self.__char_to_glyph = char_to_glyph
+
+    def covers(self, code):
+        return bool(self.__char_to_glyph.get(code))
+
+class FontChain:
+    """
+    class FontChain
+    A font followed by its fallback fonts. A character is drawn with the
+    first font of the chain that has a glyph for it. The fallback fonts are
+    only parsed when a character is not in any font before them.
+    """
+    def __init__(self, registry, font_paths, subfont_index=0):
+        self.__registry = registry
+        self.__font_paths = font_paths
+        self.__font_names = ([registry.get_font_name(font_paths[0], subfont_index)]
+                             + [None] * (len(font_paths) - 1))
+        # character -> name of the font to draw it with, or None
+        self.__resolved = {}
+
+    def get_font_name(self):
+        """
+        Returns the name of the main font.
+        """
+        return self.__font_names[0]
+
+    def resolve(self, char):
+        """
+        Returns the name of the first font that has char, or None.
+        """
+        try:
+            return self.__resolved[char]
+        except KeyError:
+            pass
+        code = ord(char)
+        font_name = None
+        for i, font_path in enumerate(self.__font_paths):
+            # only the fallback fonts can still be missing
+            if self.__font_names[i] is None:
+                self.__font_names[i] = self.__registry.get_font_name(font_path)
+            if self.__registry.get_coverage(self.__font_names[i]).covers(code):
+                font_name = self.__font_names[i]
+                break
+        self.__resolved[char] = font_name
+        return font_name
+
+    def split_runs(self, text):
+        """
+        Returns text as a list of (font name, run). Characters no font has
+        stay with the main font.
+        """
+        runs = []
+        for char in text:
+            font_name = self.resolve(char) or self.__font_names[0]
+            if runs and runs[-1][0] == font_name:
+                runs[-1][1].append(char)
+            else:
+                runs.append((font_name, [char]))
+        return [(font_name, ''.join(run)) for font_name, run in runs]
+
+    def find_missing(self, texts):
+        """
+        Returns the characters of texts that no font of the chain has,
+        sorted, as a string. Control characters such as line breaks are
+        not drawn and are ignored.
+        """
+        return ''.join(sorted(char for char in set().union(*texts)
+                              if char >= ' ' and self.resolve(char) is None))
+
+class FontRegistry:
+    """
+    class FontRegistry
+    It maps a font file to the name of an already registered reportlab font.
+    """
+    def __init__(self):
+        self.__font_names = {}
+        self.__coverages = {}
+        self.__font_chains = {}
+        self.__standard_font_names = set()
+        self.__lock = threading.Lock()
+
+    def get_font_name(self, font_path, subfont_index=0):
+        key = (os.path.abspath(font_path), subfont_index)
+        font_name = self.__font_names.get(key)
+        if font_name is not None:
+            return font_name
+        with self.__lock:
+            # another thread may have parsed it while we were waiting
+            font_name = self.__font_names.get(key)
+            if font_name is None:
+                font_name = '%s-%d' % (_FONT_NAME_PREFIX, len(self.__font_names))
+                font = TTFont(font_name, font_path, subfontIndex=subfont_index)
+                pdfmetrics.registerFont(font)
+                self.__coverages[font_name] = FontCoverage(font.face.charToGlyph)
+                self.__font_names[key] = font_name
+        return font_name
+
+    def get_coverage(self, font_name):
+        """
+        Returns the FontCoverage of a font registered by get_font_name().
+        """
+        return self.__coverages[font_name]
+
+    def get_font_chain(self, font_path, fallback_font_paths, subfont_index=0):
+        font_paths = (os.path.abspath(font_path),) + tuple(map(os.path.abspath, fallback_font_paths))
+        key = (font_paths, subfont_index)
+        font_chain = self.__font_chains.get(key)
+        if font_chain is None:
+            # creating it parses the main font, which takes the lock itself
+            font_chain = self.__font_chains.setdefault(key, FontChain(self, font_paths, subfont_index))
+        return font_chain
+
+    def get_standard_font_name(self, face_name):
+        """
+        Registers the standard CJK font face_name, e.g. MSung-Light, and
+        returns the name to draw with. It only uses the metrics bundled
+        with reportlab, so no font file is read.
+        """
+        if face_name in self.__standard_font_names:
+            return face_name
+        with self.__lock:
+            if face_name not in self.__standard_font_names:
+                font = UnicodeCIDFont(face_name)
+                if font.language == 'cht':
+                    font.encodingName = _TRADITIONAL_CHINESE_ENCODING
+                pdfmetrics.registerFont(font)
+                self.__standard_font_names.add(face_name)
+        return face_name
+
+_REGISTRY = FontRegistry()
+
+def get_font_name(font_path, subfont_index=0):
+    return _REGISTRY.get_font_name(font_path, subfont_index)
+
+def get_standard_font_name(face_name):
+    return _REGISTRY.get_standard_font_name(face_name)
+
+def get_fallback_font_paths():
+    return _FALLBACK_FONT_PATHS
+
+def get_font_chain(font_path, fallback_font_paths=None, subfont_index=0):
+    """
+    Returns the FontChain of font_path followed by fallback_font_paths,
+    by default the ones set in FALLBACK_FONT_PATHS.
+    """
+    if fallback_font_paths is None:
+        fallback_font_paths = _FALLBACK_FONT_PATHS
+    return _REGISTRY.get_font_chain(font_path, fallback_font_paths, subfont_index)
@@ -94,12 +94,17 @@ class GUI:
                       cc_list, cc_addr_list, text, output):
         self.status_label.config(text='工作中...')
         self.__change_widgets_state('disable')
-        core.generate_text_and_letter(sender_list, sender_addr_list,
-                                      receiver_list, receiver_addr_list,
-                                      cc_list, cc_addr_list,
-                                      text)
-        core.merge_text_and_letter(output)
-        core.clean_temp_files()
+        try:
+            letter = core.generate_letter(sender_list, sender_addr_list,
+                                          receiver_list, receiver_addr_list,
+                                          cc_list, cc_addr_list,
+                                          text)
+        except core.MissingGlyphError as e:
+            self.__change_widgets_state('normal')
+            self.status_label.config(text='字型缺少下列字元：' + e.characters)
+            return
+        with open(output, 'wb') as output_file:
+            output_file.write(letter)
         self.__change_widgets_state('normal')
         self.status_label.config(text='檔案已匯出至：' + output)
 
@@ -0,0 +1,92 @@
+"""
+Layout of the main article.
+It only decides which character goes into which cell of the letter grid,
+so it needs neither reportlab nor PyPDF2. Painting the result is left to
+the painter.
+"""
+from array import array
+from functools import lru_cache
+from .constants import CONTENT_MAX_CHARACTER_PER_LINE, CONTENT_MAX_LINE_PER_PAGE
+
+_LAYOUT_CACHE_SIZE = 128
+
+class PageLayout:
+    """
+    class PageLayout
+    The characters on one page as codepoints, and the grid cells they go into.
+    A cell is row * CONTENT_MAX_CHARACTER_PER_LINE + column, both counted from 0.
+    Layouts are shared through the cache, so the arrays must not be modified.
+    """
+    __slots__ = ('codepoints', 'cells', '__hash')
+
+    def __init__(self, codepoints, cells):
+        self.codepoints = codepoints
+        self.cells = cells
+        self.__hash = hash((codepoints.tobytes(), cells.tobytes()))
+
+    def __eq__(self, other):
+        return (isinstance(other, PageLayout)
+                and self.codepoints == other.codepoints and self.cells == other.cells)
+
+    def __hash__(self):
+        return self.__hash
+
+    def get_lines(self):
+        """
+        Yields (row, column, text) for every line of the page.
+        column is the cell of the first character; the rest follow it.
+        """
+        begin = 0
+        for i in range(1, len(self.cells) + 1):
+            if (i == len(self.cells)
+                    or self.cells[i] // CONTENT_MAX_CHARACTER_PER_LINE
+                    != self.cells[begin] // CONTENT_MAX_CHARACTER_PER_LINE):
+                row, column = divmod(self.cells[begin], CONTENT_MAX_CHARACTER_PER_LINE)
+                yield row, column, ''.join(map(chr, self.codepoints[begin:i]))
+                begin = i
+
+class LayoutPlan:
+    """
+    class LayoutPlan
+    The PageLayout of every page of the main article. There is always at
+    least one page, even if the article is empty.
+    """
+    __slots__ = ('pages', '__hash')
+
+    def __init__(self, pages):
+        self.pages = tuple(pages)
+        self.__hash = hash(self.pages)
+
+    def __eq__(self, other):
+        return isinstance(other, LayoutPlan) and self.pages == other.pages
+
+    def __hash__(self):
+        return self.__hash
+
+    def get_page_count(self):
+        return len(self.pages)
+
+@lru_cache(maxsize=_LAYOUT_CACHE_SIZE)
+def layout_article(main_text):
+    """
+    Breaks main_text into lines of CONTENT_MAX_CHARACTER_PER_LINE and pages
+    of CONTENT_MAX_LINE_PER_PAGE lines. A new page is only started when a
+    character has to be put on it, so trailing line breaks do not add pages.
+    """
+    pages = []
+    codepoints, cells = array('I'), array('H')
+    row, column = 0, 0
+    for char in main_text:
+        if char == '\n' or column >= CONTENT_MAX_CHARACTER_PER_LINE:
+            row, column = row + 1, 0
+            if char == '\n':
+                continue
+        if row >= CONTENT_MAX_LINE_PER_PAGE:
+            pages.append(PageLayout(codepoints, cells))
+            codepoints, cells = array('I'), array('H')
+            row, column = 0, 0
+        codepoints.append(ord(char))
+        cells.append(row * CONTENT_MAX_CHARACTER_PER_LINE + column)
+        column += 1
+    pages.append(PageLayout(codepoints, cells))
+    return LayoutPlan(pages)
@@ -0,0 +1,171 @@
+"""
+Content-addressed cache of finished letters.
+A letter is identified by a hash of everything that goes into it: the
+names, the addresses, the main article, the letter form and the font.
+The PDF painter writes invariant documents, so the same key always
+stands for the same bytes and a cached letter can be returned as is.
+"""
+import os
+import json
+import hashlib
+import tempfile
+import threading
+from collections import OrderedDict
+from functools import lru_cache
+from . import fontregistry
+from .constants import LETTER_FORMAT_PATH, DEFAULT_FONT_PATH, \
+                       FONT_MODE_EMBEDDED, FONT_MODE_STANDARD, STANDARD_FONT_NAME
+
+_KEY_VERSION = 3
+_LETTER_SUFFIX = '.pdf'
+_HASH_BLOCK_SIZE = 1 << 20
+
+@lru_cache(maxsize=16)
+def _hash_file(path, mtime, size):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(_HASH_BLOCK_SIZE), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+def get_file_version(path):
+    """
+    Returns the sha256 of the file. It is only computed again when the
+    modification time or the size of the file changes.
+    """
+    path = os.path.abspath(path)
+    stat = os.stat(path)
+    return _hash_file(path, stat.st_mtime_ns, stat.st_size)
+
+def make_key(senders, senders_addr, receivers, receivers_addr, ccs, cc_addr, main_text,
+             template_path=LETTER_FORMAT_PATH, font_path=DEFAULT_FONT_PATH,
+             font_mode=FONT_MODE_EMBEDDED, fallback_font_paths=None):
+    """
+    Returns the cache key of a letter, a hex string.
+    The inputs are serialized canonically, so equal inputs always give the
+    same key, and the key changes whenever the letter form or the font does.
+    In FONT_MODE_STANDARD the font file is not used, so it is not hashed either.
+    fallback_font_paths defaults to the fallback fonts of the font registry.
+    """
+    if font_mode == FONT_MODE_STANDARD:
+        font_version = STANDARD_FONT_NAME
+    else:
+        if fallback_font_paths is None:
+            fallback_font_paths = fontregistry.get_fallback_font_paths()
+        font_version = [get_file_version(path) for path in (font_path,) + tuple(fallback_font_paths)]
+    payload = json.dumps([_KEY_VERSION,
+                          senders, senders_addr, receivers, receivers_addr,
+                          ccs, cc_addr, main_text,
+                          get_file_version(template_path), font_mode, font_version],
+                         ensure_ascii=False, separators=(',', ':'), default=str)
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+class LetterCache:
+    """
+    class LetterCache
+    It keeps finished letters in a memory LRU of at most max_bytes and,
+    if disk_dir is given, in a directory of at most disk_max_bytes.
+    Letters evicted from memory stay on disk, and letters found on disk are
+    brought back into memory. The directory may be shared by several
+    processes; files are written atomically and the oldest are removed first.
+    """
+    def __init__(self, max_bytes, disk_dir=None, disk_max_bytes=0):
+        self.__max_bytes = max_bytes
+        self.__letters = OrderedDict()
+        self.__size = 0
+        self.__disk_dir = disk_dir
+        self.__disk_max_bytes = disk_max_bytes
+        self.__disk_size = 0
+        self.__lock = threading.Lock()
+        if self.__disk_dir:
+            os.makedirs(self.__disk_dir, exist_ok=True)
+            self.__disk_size = sum(size for _, size, _ in self.__list_disk_letters())
+
+    def get(self, key):
+        """
+        Returns the letter as bytes, or None if it is not cached.
+        """
+        with self.__lock:
+            letter = self.__letters.get(key)
+            if letter is not None:
+                self.__letters.move_to_end(key)
+                return letter
+        letter = self.__read_disk_letter(key)
+        if letter is not None:
+            self.__put_memory(key, letter)
+        return letter
+
+    def put(self, key, letter):
+        self.__put_memory(key, letter)
+        self.__write_disk_letter(key, letter)
+
+    def __put_memory(self, key, letter):
+        if len(letter) > self.__max_bytes:
+            return
+        with self.__lock:
+            old_letter = self.__letters.pop(key, None)
+            if old_letter is not None:
+                self.__size -= len(old_letter)
+            self.__letters[key] = letter
+            self.__size += len(letter)
+            while self.__size > self.__max_bytes:
+                _, evicted = self.__letters.popitem(last=False)
+                self.__size -= len(evicted)
+
+    def __get_disk_path(self, key):
+        return os.path.join(self.__disk_dir, key + _LETTER_SUFFIX)
+
+    def __read_disk_letter(self, key):
+        if not self.__disk_dir:
+            return None
+        path = self.__get_disk_path(key)
+        try:
+            with open(path, 'rb') as f:
+                letter = f.read()
+            # mark it as recently used for the eviction
+            os.utime(path)
+        except OSError:
+            return None
+        return letter
+
+    def __write_disk_letter(self, key, letter):
+        if not self.__disk_dir or len(letter) > self.__disk_max_bytes:
+            return
+        path = self.__get_disk_path(key)
+        if os.path.exists(path):
+            return
+        try:
+            fd, temp_path = tempfile.mkstemp(dir=self.__disk_dir, suffix='.tmp')
+            with os.fdopen(fd, 'wb') as f:
+                f.write(letter)
+            os.replace(temp_path, path)
+        except OSError as e:
+            print('[WARN] Cannot write letter cache:', e)
+            return
+        with self.__lock:
+            self.__disk_size += len(letter)
+            if self.__disk_size <= self.__disk_max_bytes:
+                return
+            self.__evict_disk_letters()
+
+    def __list_disk_letters(self):
+        for entry in os.scandir(self.__disk_dir):
+            if entry.name.endswith(_LETTER_SUFFIX):
+                try:
+                    stat = entry.stat()
+                except OSError:
+                    continue
+                yield entry.path, stat.st_size, stat.st_mtime
+
+    def __evict_disk_letters(self):
+        # other processes may share the directory, so count it again
+        letters = sorted(self.__list_disk_letters(), key=lambda letter: letter[2])
+        self.__disk_size = sum(size for _, size, _ in letters)
+        for path, size, _ in letters:
+            if self.__disk_size <= self.__disk_max_bytes:
+                break
+            try:
+                os.remove(path)
+            except OSError:
+                continue
+            self.__disk_size -= size
@@ -1,63 +1,202 @@
+import inspect
+import threading
 from PyPDF2 import PdfFileWriter, PdfFileReader
+from PyPDF2.generic import (ArrayObject, DecodedStreamObject, DictionaryObject,
+                            IndirectObject, NameObject, StreamObject)
 
-# TODO: create an abstract or interface class
+_TEMPLATE_XOBJECT_NAME = '/LetterTemplate'
+_TEMPLATE_DRAW_OPERATORS = ('q %s Do Q\n' % _TEMPLATE_XOBJECT_NAME).encode('ascii')
 
-class PDFPagePick:
+def _write_pdf(writer, output):
+    # output could be a filename or a file-like object such as BytesIO
+    if hasattr(output, 'write'):
+        writer.write(output)
+        return
+    outputstream = open(output, 'wb')
+    writer.write(outputstream)
+    outputstream.close()
+
+def _supports_object_streams():
+    try:
+        return 'useObjectStreams' in inspect.signature(PdfFileWriter).parameters
+    except (TypeError, ValueError):
+        return False
+
+# only the PyPDF2 in dep/ can pack objects into PDF 1.5 object streams, which
+# makes the letters smaller; the PyPDF2 in requirements.txt writes classic files
+_USE_OBJECT_STREAMS = _supports_object_streams()
+
+def _new_writer():
+    if _USE_OBJECT_STREAMS:
+        return PdfFileWriter(useObjectStreams=True)
+    return PdfFileWriter()
+
+def _add_object(writer, obj):
+    # PyPDF2 2.x renamed PdfFileWriter._addObject to _add_object
+    add_object = getattr(writer, '_add_object', None) or writer._addObject
+    return add_object(obj)
+
+class LetterTemplate:
     """
-    class PDFPagePick
-    Select any page you want and then organize them into a new PDF file
+    class LetterTemplate
+    One page of the letter form, parsed once and kept in memory.
+    The page is turned into a Form XObject whose objects are all resolved
+    up front, so it is never read from the file or tokenized again.
+    It must be treated as immutable; use add_to() to get a copy that
+    belongs to an output document.
     """
-    def __init__(self, src, output_filename):
-        self.__src = PdfFileReader(src)
-        self.__output = PdfFileWriter()
-        self.__output_filename = output_filename
+    def __init__(self, src, page_num=0):
+        reader = PdfFileReader(src)
+        page = reader.getPage(page_num)
+        self.__media_box = ArrayObject(page.mediaBox)
+        self.__form = self.__make_form(page)
 
-    def pick_individual_pages(self, page_num_list):
-        for page_num in page_num_list:
-            if self.__check_page_num(self.__src, page_num) is True:
-                self.__output.addPage(self.__src.getPage(page_num))
-            else:
-                print('pageNum %d doesn''t exist. Pass' % page_num)
+    def get_media_box(self):
+        return ArrayObject(self.__media_box)
 
-    def insert_blank_page(self):
-        self.__output.addBlankPage()
+    def get_form(self):
+        """
+        Returns the Form XObject itself. It must not be modified.
+        """
+        return self.__form
 
-    def save(self):
-        outputstream = open(self.__output_filename, 'wb')
-        self.__output.write(outputstream)
-        outputstream.close()
+    def add_to(self, writer):
+        """
+        Copies the Form XObject into writer and returns its reference.
+        Only the object tree is copied; stream data is shared.
+        """
+        return self.__copy(self.__form, writer, {})
 
-    def __check_page_num(self, target, page_num):
-        if page_num < 0 or page_num > target.getNumPages()-1:
-            print('Invalid pageNum')
-            return False
-        return True
+    def __make_form(self, page):
+        contents = page.getContents()
+        if isinstance(contents, StreamObject):
+            # keep the encoded data as it is, no decoding is needed
+            form = self.__resolve(contents, {})
+        else:
+            # an array of content streams, or none; join them once, here
+            form = DecodedStreamObject()
+            form._data = b'\n'.join(stream.getObject().getData() for stream in contents or ())
+        form[NameObject('/Type')] = NameObject('/XObject')
+        form[NameObject('/Subtype')] = NameObject('/Form')
+        form[NameObject('/BBox')] = ArrayObject(self.__media_box)
+        form[NameObject('/Resources')] = self.__resolve(page['/Resources'], {})
+        return form
+
+    def __resolve(self, obj, memo):
+        # replaces every indirect reference with the object itself
+        if isinstance(obj, IndirectObject):
+            key = (obj.idnum, obj.generation)
+            if key not in memo:
+                memo[key] = self.__resolve(obj.getObject(), memo)
+            return memo[key]
+        if isinstance(obj, DictionaryObject):
+            ret_value = obj.__class__()
+            if isinstance(obj, StreamObject):
+                ret_value._data = obj._data
+            for key, value in obj.items():
+                if key not in ('/Parent', '/Length'):
+                    ret_value[key] = self.__resolve(value, memo)
+            return ret_value
+        if isinstance(obj, ArrayObject):
+            return ArrayObject([self.__resolve(value, memo) for value in obj])
+        return obj
+
+    def __copy(self, obj, writer, memo):
+        # streams must be indirect objects; shared streams are added only once
+        if id(obj) in memo:
+            return memo[id(obj)]
+        if isinstance(obj, DictionaryObject):
+            ret_value = obj.__class__()
+            if isinstance(obj, StreamObject):
+                ret_value._data = obj._data
+            for key, value in obj.items():
+                ret_value[key] = self.__copy(value, writer, memo)
+            if isinstance(obj, StreamObject):
+                ret_value = _add_object(writer, ret_value)
+                memo[id(obj)] = ret_value
+            return ret_value
+        if isinstance(obj, ArrayObject):
+            return ArrayObject([self.__copy(value, writer, memo) for value in obj])
+        return obj
+
+_LETTER_TEMPLATES = {}
+_LETTER_TEMPLATES_LOCK = threading.Lock()
+
+def get_letter_template(src, page_num=0):
+    """
+    Returns the LetterTemplate of the page, which is parsed only once per process.
+    """
+    key = (src, page_num)
+    template = _LETTER_TEMPLATES.get(key)
+    if template is not None:
+        return template
+    with _LETTER_TEMPLATES_LOCK:
+        template = _LETTER_TEMPLATES.get(key)
+        if template is None:
+            template = LetterTemplate(src, page_num)
+            _LETTER_TEMPLATES[key] = template
+    return template
 
-class PDFPageMerge:
+class PDFPageStamp:
     """
-    class PDFMerge
-    It merges 2 pdf files into a new one.
+    class PDFPageStamp
+    It puts the pages of a pdf file onto a LetterTemplate, or onto blank
+    pages of the same size, and organizes them into a new PDF file.
+    src and output_filename could be either filenames or file-like objects.
     """
-    def __init__(self, src, dest, output_filename):
+    def __init__(self, src, template, output_filename):
         self.__src = PdfFileReader(src)
-        self.__dest = PdfFileReader(dest)
+        self.__template = template
         self.__output_filename = output_filename
-        self.__output = PdfFileWriter()
+        self.__output = _new_writer()
+        self.__template_ref = None
+        self.__draw_template_ref = None
+
+    def stamp_src_page(self, src_page_num):
+        if self.__check_page_num(self.__src, src_page_num) is True:
+            page = self.__prepare_src_page(src_page_num)
+            self.__draw_template_under(page)
+            self.__output.addPage(page)
 
-    def merge_src_page_to_dest_page(self, src_page_num, dest_page_num):
-        if (self.__check_page_num(self.__src, src_page_num) is True
-                and self.__check_page_num(self.__dest, dest_page_num) is True):
-            dest_page = self.__dest.getPage(dest_page_num)
-            dest_page.mergePage(self.__src.getPage(src_page_num))
-            self.__output.addPage(dest_page)
+    def copy_src_page(self, src_page_num):
+        if self.__check_page_num(self.__src, src_page_num) is True:
+            self.__output.addPage(self.__prepare_src_page(src_page_num))
 
     def get_src_total_page(self):
         return self.__src.getNumPages()
 
     def save(self):
-        outputstream = open(self.__output_filename, 'wb')
-        self.__output.write(outputstream)
-        outputstream.close()
+        _write_pdf(self.__output, self.__output_filename)
+
+    def __prepare_src_page(self, src_page_num):
+        page = self.__src.getPage(src_page_num)
+        page[NameObject('/MediaBox')] = self.__template.get_media_box()
+        return page
+
+    def __draw_template_under(self, page):
+        if self.__template_ref is None:
+            self.__template_ref = self.__template.add_to(self.__output)
+            draw_template = DecodedStreamObject()
+            draw_template._data = _TEMPLATE_DRAW_OPERATORS
+            self.__draw_template_ref = _add_object(self.__output, draw_template)
+
+        resources = DictionaryObject()
+        resources.update(page['/Resources'])
+        xobjects = DictionaryObject()
+        if '/XObject' in resources:
+            xobjects.update(resources['/XObject'])
+        xobjects[NameObject(_TEMPLATE_XOBJECT_NAME)] = self.__template_ref
+        resources[NameObject('/XObject')] = xobjects
+        page[NameObject('/Resources')] = resources
+
+        # the content streams are referenced as they are, not parsed
+        if '/Contents' not in page:
+            contents = ArrayObject()
+        elif isinstance(page['/Contents'], ArrayObject):
+            contents = ArrayObject(page['/Contents'])
+        else:
+            contents = ArrayObject([page.raw_get('/Contents')])
+        page[NameObject('/Contents')] = ArrayObject([self.__draw_template_ref] + contents)
 
     def __check_page_num(self, target, page_num):
         if page_num < 0 or page_num > target.getNumPages()-1:
@@ -1,44 +1,205 @@
+import threading
+from io import BytesIO
+from reportlab import rl_config
 from reportlab.pdfgen import canvas
-from reportlab.pdfbase.ttfonts import TTFont
-from reportlab.pdfbase import pdfmetrics
+from reportlab.pdfbase import pdfdoc
+from PyPDF2.generic import ArrayObject, DictionaryObject, StreamObject
+from . import fontregistry
 
-_DEFAULT_FONT_NAME = 'user-sepecified-font'
 _DEFAULT_FONT_SIZE = 20
 _POINT = 1
+_TEMPLATE_FORM_NAME = 'LetterTemplate'
+
+# Saves are serialized, for two reasons:
+# - reportlab has no per-document switch for ASCII85; it reads the
+#   process-wide rl_config.useA85 while it writes a document, and painters
+#   change it only for the duration of their save.
+# - the font subsets are made while saving, from the TTFont faces the font
+#   registry shares between all painters. reportlab reads the glyphs through
+#   the file position of the face, so two threads subsetting the same face
+#   at once could copy each other's glyphs into their subsets.
+_SAVE_LOCK = threading.Lock()
 
 class PDFPainter:
     """
     class PDFPainter
     It creates a temporary pdf file for merging.
+    filename could be either a filename or a file-like object such as BytesIO.
+    If intermediate is True, the document is only an intermediate one, such as
+    the text layer that is stamped onto the letter form afterwards, and its
+    streams are written without ASCII85, which would only make them a quarter
+    larger and slower to decode.
     """
-    def __init__(self, filename, wide, height):
-        self.__canvas = canvas.Canvas(filename, pagesize=(wide, height))
+    def __init__(self, filename, wide, height, intermediate=False):
+        # invariant: fixed creation date and document ID, so the same input
+        # always produces the same bytes
+        self.__canvas = canvas.Canvas(filename, pagesize=(wide, height), invariant=1)
         self.__canvas.setStrokeColorRGB(0, 0, 0)
         self.__canvas.setFillColorRGB(0, 0, 0)
+        self.__font_name = None
+        self.__font_chain = None
         self.__font_size = _DEFAULT_FONT_SIZE
+        self.__use_template = False
+        self.__page_begun = False
+        self.__intermediate = intermediate
+
+    def use_template(self, template):
+        """
+        Draws template, a pdfpage.LetterTemplate, under every following page.
+        The template is embedded only once, as a Form XObject, and each page
+        draws it with a single Do operator, so no merging is needed afterwards.
+        """
+        document = self.__canvas._doc
+        if not document.hasForm(_TEMPLATE_FORM_NAME):
+            form = _to_reportlab_stream(template.get_form(), document, {})
+            document.Reference(form, pdfdoc.xObjectName(_TEMPLATE_FORM_NAME))
+        media_box = [float(n) for n in template.get_media_box()]
+        self.__canvas.setPageSize((media_box[2] - media_box[0], media_box[3] - media_box[1]))
+        self.__use_template = True
 
-    def set_font(self, font_path, font_size=_DEFAULT_FONT_SIZE):
-        pdfmetrics.registerFont(TTFont(_DEFAULT_FONT_NAME, font_path))
+    def skip_template_on_this_page(self):
+        """
+        The current page will be a blank page. Call it before drawing anything on it.
+        """
+        self.__page_begun = True
+        self.__apply_font()
+
+    def set_font(self, font_path, font_size=_DEFAULT_FONT_SIZE, subfont_index=0):
+        # the font is parsed only once per process; afterwards only the size changes
+        # characters the font lacks are drawn with the fallback fonts
+        self.__font_chain = fontregistry.get_font_chain(font_path, subfont_index=subfont_index)
+        self.__font_name = self.__font_chain.get_font_name()
+        self.__font_size = font_size
+        self.__apply_font()
+
+    def set_standard_font(self, face_name, font_size=_DEFAULT_FONT_SIZE):
+        """
+        Uses the standard CJK font face_name, which is not embedded.
+        """
+        self.__font_name = fontregistry.get_standard_font_name(face_name)
+        self.__font_chain = None
         self.__font_size = font_size
-        self.__canvas.setFont(_DEFAULT_FONT_NAME, self.__font_size * _POINT)
+        self.__apply_font()
 
     def draw_string(self, x_begin, y_begin, text):
-        self.__canvas.drawString(x_begin, y_begin, text)
+        self.__begin_page()
+        runs = self.__split_runs(text)
+        if not runs or (len(runs) == 1 and runs[0][0] == self.__font_name):
+            self.__canvas.drawString(x_begin, y_begin, text)
+            return
+        # some characters come from fallback fonts
+        text_object = self.__canvas.beginText(x_begin, y_begin)
+        for font_name, run in runs:
+            text_object.setFont(font_name, self.__font_size * _POINT)
+            text_object.textOut(run)
+        self.__canvas.drawText(text_object)
+
+    def draw_grid_text(self, x_begin, y_begin, text, x_interval):
+        """
+        Draws text as a single text object, putting the characters x_interval
+        apart no matter how wide each glyph is. The gap after each glyph is
+        set with the character spacing, which only changes when the glyph
+        width does.
+        """
+        self.__begin_page()
+        text_object = self.__canvas.beginText(x_begin, y_begin)
+        run = ''
+        char_space = None
+        font_name = self.__font_name
+        for char in text:
+            new_font_name = self.__resolve_font(char)
+            new_char_space = x_interval - self.__canvas.stringWidth(char, new_font_name,
+                                                                    self.__font_size * _POINT)
+            if new_font_name != font_name or new_char_space != char_space:
+                if run:
+                    text_object.textOut(run)
+                    run = ''
+                if new_font_name != font_name:
+                    text_object.setFont(new_font_name, self.__font_size * _POINT)
+                    font_name = new_font_name
+                if new_char_space != char_space:
+                    text_object.setCharSpace(new_char_space)
+                    char_space = new_char_space
+            run += char
+        if run:
+            text_object.textOut(run)
+        self.__canvas.drawText(text_object)
 
     def draw_line(self, x_begin, y_begin, x_end, y_end):
+        self.__begin_page()
         self.__canvas.line(x_begin, y_begin, x_end, y_end)
 
     def draw_rect(self, x_begin, y_begin, width, height):
+        self.__begin_page()
         self.__canvas.rect(x_begin, y_begin, width, height)
 
     def end_this_page(self):
+        self.__begin_page()
         self.__canvas.showPage()
-        # keep the font setting
-        self.__canvas.setFont(_DEFAULT_FONT_NAME, self.__font_size * _POINT)
+        self.__page_begun = False
 
     def save(self):
         """
         Saves and close the PDF document in the file.
         After this operation the canvas must not be used further.
         """
-        self.__canvas.save()
+        with _SAVE_LOCK:
+            use_a85 = rl_config.useA85
+            if self.__intermediate:
+                rl_config.useA85 = 0
+            try:
+                self.__canvas.save()
+            finally:
+                rl_config.useA85 = use_a85
+
+    def __begin_page(self):
+        # the template goes first so that everything else is drawn over it
+        if self.__page_begun:
+            return
+        self.__page_begun = True
+        if self.__use_template:
+            self.__canvas.doForm(_TEMPLATE_FORM_NAME)
+        # the canvas forgets the font on every new page
+        self.__apply_font()
+
+    def __resolve_font(self, char):
+        if self.__font_chain is None:
+            return self.__font_name
+        return self.__font_chain.resolve(char) or self.__font_name
+
+    def __split_runs(self, text):
+        if self.__font_chain is None:
+            return [(self.__font_name, text)]
+        return self.__font_chain.split_runs(text)
+
+    def __apply_font(self):
+        # a font that is not embedded writes a Tf operator to the page, which
+        # would make the canvas output an extra page after the last one, so
+        # it is only set once something is drawn on the page
+        if self.__font_name is not None and self.__page_begun:
+            self.__canvas.setFont(self.__font_name, self.__font_size * _POINT)
+
+def _to_reportlab_stream(stream, document, memo):
+    # stream data is kept as it is; reportlab won't filter it again as long as /Filter is set
+    dictionary = _to_reportlab(DictionaryObject(
+        (key, value) for key, value in stream.items() if key != '/Length'), document, memo)
+    return pdfdoc.PDFStream(dictionary, stream._data)
+
+def _to_reportlab(obj, document, memo):
+    """
+    Converts a resolved PyPDF2 object into its reportlab counterpart.
+    Streams become indirect objects of document; everything else is
+    formatted by PyPDF2 itself.
+    """
+    if isinstance(obj, StreamObject):
+        if id(obj) not in memo:
+            memo[id(obj)] = document.Reference(_to_reportlab_stream(obj, document, memo))
+        return memo[id(obj)]
+    if isinstance(obj, DictionaryObject):
+        return pdfdoc.PDFDictionary(dict((key[1:], _to_reportlab(value, document, memo))
+                                         for key, value in obj.items()))
+    if isinstance(obj, ArrayObject):
+        return pdfdoc.PDFArray([_to_reportlab(value, document, memo) for value in obj])
+    token = BytesIO()
+    obj.writeToStream(token, None)
+    return token.getvalue()
@@ -0,0 +1,85 @@
+"""
+Per-render scratch state.
+"""
+from io import BytesIO
+from . import pdfpage
+from . import pdfpainter
+from .constants import LETTER_FORMAT_PATH, LETTER_FORMAT_WIDE_HEIGHT, DEFAULT_FONT_PATH, \
+                       FONT_MODE_EMBEDDED, FONT_MODE_STANDARD, STANDARD_FONT_NAME
+
+class RenderContext:
+    """
+    class RenderContext
+    It owns everything one letter needs while it is being rendered: the
+    in-memory buffer, the painter, the kinds of the pages and the font state.
+    Nothing is shared between contexts except the immutable letter
+    template, so many letters can be rendered at the same time in one process.
+    In single pass mode the letter form is drawn by the painter itself and
+    the painter's output is the finished PDF. Otherwise the text layer is
+    stamped onto the letter form afterwards.
+    In FONT_MODE_STANDARD the text is drawn with STANDARD_FONT_NAME instead of
+    the font at font_path, which is then never read.
+    """
+    def __init__(self, font_path=DEFAULT_FONT_PATH, single_pass=True,
+                 font_mode=FONT_MODE_EMBEDDED):
+        self.__font_path = font_path
+        self.__font_mode = font_mode
+        self.__single_pass = single_pass
+        self.__text_stream = BytesIO()
+        # True for a page printed on the letter form, False for a blank one
+        self.__letter_pages = []
+        self.painter = pdfpainter.PDFPainter(self.__text_stream,
+                                             LETTER_FORMAT_WIDE_HEIGHT[0],
+                                             LETTER_FORMAT_WIDE_HEIGHT[1],
+                                             intermediate=not single_pass)
+        if self.__single_pass:
+            self.painter.use_template(pdfpage.get_letter_template(LETTER_FORMAT_PATH))
+
+    def set_font_size(self, font_size):
+        if self.__font_mode == FONT_MODE_STANDARD:
+            self.painter.set_standard_font(STANDARD_FONT_NAME, font_size)
+        else:
+            self.painter.set_font(self.__font_path, font_size)
+
+    def end_letter_page(self):
+        """
+        Ends the current page, which will be printed on the letter form.
+        """
+        self.painter.end_this_page()
+        self.__letter_pages.append(True)
+
+    def begin_blank_page(self):
+        """
+        The current page will be printed on a blank page.
+        Call it before drawing anything on the page.
+        """
+        self.painter.skip_template_on_this_page()
+
+    def end_blank_page(self):
+        """
+        Ends the current page, which will be printed on a blank page.
+        """
+        self.painter.end_this_page()
+        self.__letter_pages.append(False)
+
+    def render(self):
+        """
+        Finishes the letter and returns the PDF as bytes.
+        After this operation the context must not be used further.
+        """
+        self.painter.save()
+        if self.__single_pass:
+            return self.__text_stream.getvalue()
+        self.__text_stream.seek(0)
+        output_stream = BytesIO()
+        print('Merging...')
+        page_stamp = pdfpage.PDFPageStamp(self.__text_stream,
+                                          pdfpage.get_letter_template(LETTER_FORMAT_PATH),
+                                          output_stream)
+        for i in range(page_stamp.get_src_total_page()):
+            if self.__letter_pages[i]:
+                page_stamp.stamp_src_page(i)
+            else:
+                page_stamp.copy_src_page(i)
+        page_stamp.save()
+        return output_stream.getvalue()
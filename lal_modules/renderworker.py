@@ -0,0 +1,18 @@
+"""
+Worker side of the process pool render mode.
+Importing this module loads reportlab, PyPDF2, the letter template and the
+default font. The server lists it in the forkserver preload, so every
+render worker is forked with all of them already in memory.
+"""
+from . import core
+
+def warm_up():
+    """
+    Does nothing; submitting it makes the pool start a worker in advance.
+    """
+    return True
+
+try:
+    core.preload_resources()
+except Exception as e:
+    print(f'[WARN] preload_resources failed: {e}')
@@ -1,15 +1,18 @@
 import uvicorn, os, json, time, threading, hashlib, urllib.parse
-import tempfile
-import shutil
+import sys
+import asyncio
+import functools
+import multiprocessing
+from concurrent.futures import Executor, ThreadPoolExecutor, ProcessPoolExecutor
 from datetime import datetime
 from fastapi import FastAPI, Request
-from fastapi.responses import HTMLResponse, StreamingResponse, PlainTextResponse
+from fastapi.responses import HTMLResponse, PlainTextResponse, Response
 from fastapi.templating import Jinja2Templates
 from fastapi.staticfiles import StaticFiles
 import random
 import string
 import pymysql
-from lal_modules import core
+from lal_modules import core, lettercache
 
 
 app = FastAPI()
@@ -18,6 +21,73 @@ templates = Jinja2Templates(directory="templates")
 app.mount("/static", StaticFiles(directory="static"), name="static")
 
 
+
+class RecyclingProcessPoolExecutor(Executor):
+    """
+    Python 3.11 以前的 ProcessPoolExecutor 不支援 max_tasks_per_child，
+    改為每送出 max_tasks 份工作就換成新的行程池，舊的行程池做完手上的工作後即結束
+    """
+    def __init__(self, create_pool, max_tasks):
+        self._create_pool = create_pool
+        self._max_tasks = max_tasks
+        self._lock = threading.Lock()
+        self._pool = create_pool()
+        self._tasks = 0
+
+    def submit(self, fn, /, *args, **kwargs):
+        with self._lock:
+            if self._tasks >= self._max_tasks:
+                old_pool, self._pool = self._pool, self._create_pool()
+                self._tasks = 0
+                old_pool.shutdown(wait=False)
+            self._tasks += 1
+            return self._pool.submit(fn, *args, **kwargs)
+
+    def shutdown(self, wait=True, **kwargs):
+        with self._lock:
+            self._pool.shutdown(wait=wait, **kwargs)
+
+
+def create_render_executor():
+    """
+    產生 PDF 是 CPU 密集的工作，交給獨立的執行緒池或行程池處理，避免卡住 event loop
+    RENDER_MODE=process 時使用行程池，可同時用到多個 CPU 核心
+    """
+    pool_size = int(os.getenv("RENDER_POOL_SIZE", "2"))
+    if os.getenv("RENDER_MODE", "thread") != "process":
+        return ThreadPoolExecutor(max_workers=pool_size, thread_name_prefix="render")
+
+    # worker 由預先載入字型、信函範本及 reportlab/PyPDF2 的 forkserver 產生
+    context = multiprocessing.get_context("forkserver")
+    context.set_forkserver_preload(["lal_modules.renderworker"])
+    max_tasks = os.getenv("RENDER_MAX_TASKS_PER_WORKER", "")
+    if not max_tasks:
+        return ProcessPoolExecutor(max_workers=pool_size, mp_context=context)
+    if sys.version_info >= (3, 11):
+        return ProcessPoolExecutor(max_workers=pool_size, mp_context=context,
+                                   max_tasks_per_child=int(max_tasks))
+    # 整個行程池平均每個行程處理 max_tasks 份信函後換新
+    return RecyclingProcessPoolExecutor(
+        functools.partial(ProcessPoolExecutor, max_workers=pool_size, mp_context=context),
+        int(max_tasks) * pool_size)
+
+
+def create_letter_cache():
+    """
+    相同內容的信函直接使用先前產生的 PDF，不重新產生
+    """
+    return lettercache.LetterCache(
+        max_bytes=int(os.getenv("LETTER_CACHE_SIZE_MB", "64")) * 1024 * 1024,
+        disk_dir=os.getenv("LETTER_CACHE_DIR") or None,
+        disk_max_bytes=int(os.getenv("LETTER_CACHE_DISK_SIZE_MB", "512")) * 1024 * 1024)
+
+
+# 在 startup 時才建立：forkserver 會以 __mp_main__ 的名義重新匯入 `python server.py` 的本檔，
+# 放在模組層級的話，每次匯入都會再建立一個行程池與快取
+render_executor = None
+letter_cache = None
+
+
 def load_env_file(path: str):
     if not path or not os.path.exists(path):
         return
@@ -97,10 +167,26 @@ def gen_trade_no() -> str:
 
 @app.on_event("startup")
 def startup_event():
+    global render_executor, letter_cache
+    render_executor = create_render_executor()
+    letter_cache = create_letter_cache()
     try:
         ensure_payment_table()
     except Exception as e:
         print(f"[WARN] ensure_payment_table failed: {e}")
+    try:
+        core.preload_resources()
+    except Exception as e:
+        print(f"[WARN] preload_resources failed: {e}")
+    if not isinstance(render_executor, ThreadPoolExecutor):
+        from lal_modules import renderworker
+        for _ in range(int(os.getenv("RENDER_POOL_SIZE", "2"))):
+            render_executor.submit(renderworker.warm_up)
+
+
+@app.on_event("shutdown")
+def shutdown_event():
+    render_executor.shutdown(wait=True)
 
 
 @app.get("/", response_class=HTMLResponse)
@@ -339,34 +425,40 @@ async def generate(request: Request):
     if not text:
         return
 
-    # 建立唯一暫存目錄
-    temp_dir = tempfile.mkdtemp()
-    output_filename = os.path.join(temp_dir, generate_random_string(4) + "_output.pdf")
-
-    # 產生 PDF
-    core.generate_text_and_letter(senders, senders_addr,
-                                  receivers, receivers_addr,
-                                  ccs, cc_addr,
-                                  text)
-    core.merge_text_and_letter(output_filename)
-    core.clean_temp_files()
-    print('Done. Filename: ', output_filename)
-    
-    def file_iterator(file_path):
-        with open(file_path, "rb") as f:
-            yield from f
-        # 傳送完畢後刪除檔案與資料夾
+    # font_mode 為 standard 時使用不內嵌的標準字型 (MSung-Light)，檔案較小，適合線上預覽
+    font_mode = json_request.get("font_mode", core.FONT_MODE_EMBEDDED)
+    if font_mode not in core.FONT_MODES:
+        return PlainTextResponse(f"Unknown font_mode: {font_mode}", status_code=400)
+
+    # 以內容的雜湊值作為 ETag；計算雜湊值與讀寫磁碟快取都會阻塞，交給預設的執行緒池處理
+    loop = asyncio.get_running_loop()
+    letter_key = await loop.run_in_executor(None, functools.partial(lettercache.make_key,
+                                                                    senders, senders_addr,
+                                                                    receivers, receivers_addr,
+                                                                    ccs, cc_addr,
+                                                                    text, font_mode=font_mode))
+    headers = {"ETag": f'"{letter_key}"', "Content-Disposition": "attachment; filename=letter.pdf"}
+
+    letter = await loop.run_in_executor(None, letter_cache.get, letter_key)
+    if letter is None:
+        # 產生 PDF (全程在記憶體中完成，不寫入暫存檔)
         try:
-            os.remove(file_path)
-            shutil.rmtree(temp_dir, ignore_errors=True)
-            print(f"已刪除檔案與資料夾: {file_path}, {temp_dir}")
-        except Exception as e:
-            print(f"刪除檔案時發生錯誤: {str(e)}")
-
-    return StreamingResponse(
-        file_iterator(output_filename),
+            letter = await loop.run_in_executor(render_executor,
+                                                functools.partial(core.generate_letter,
+                                                                  senders, senders_addr,
+                                                                  receivers, receivers_addr,
+                                                                  ccs, cc_addr,
+                                                                  text, font_mode=font_mode))
+        except core.MissingGlyphError as e:
+            # 字型與備用字型都沒有的字元，在排版前就回報，不產生缺字的信函
+            return PlainTextResponse(f"字型缺少下列字元: {e.characters}", status_code=422)
+        await loop.run_in_executor(None, letter_cache.put, letter_key, letter)
+        print('Done. Size: ', len(letter))
+
+    return Response(
+        content=letter,
         media_type="application/pdf",
-        headers={"Content-Disposition": "attachment; filename=letter.pdf"}
+        headers=headers
     )
 
 
@@ -0,0 +1,29 @@
+import os
+import sys
+import unittest
+from io import BytesIO
+from PyPDF2 import PdfFileWriter
+from PyPDF2.generic import ArrayObject, DecodedStreamObject, NameObject
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from lal_modules import pdfpage
+
+class LetterTemplateTest(unittest.TestCase):
+    def test_multi_stream_template(self):
+        writer = PdfFileWriter()
+        page = writer.addBlankPage(100, 100)
+        contents = ArrayObject()
+        for data in (b'0 0 m', b'10 10 l S'):
+            stream = DecodedStreamObject()
+            stream.setData(data)
+            contents.append(pdfpage._add_object(writer, stream))
+        page[NameObject('/Contents')] = contents
+        src = BytesIO()
+        writer.write(src)
+
+        template = pdfpage.LetterTemplate(src)
+        self.assertEqual(template.get_form().getData(), b'0 0 m\n10 10 l S')
+        self.assertEqual([float(n) for n in template.get_media_box()], [0, 0, 100, 100])
+
+if __name__ == '__main__':
+    unittest.main()
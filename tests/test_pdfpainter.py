@@ -0,0 +1,41 @@
+import os
+import sys
+import unittest
+from concurrent.futures import ThreadPoolExecutor
+from io import BytesIO
+import reportlab
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from lal_modules import pdfpainter
+
+_FONT_PATH = os.path.join(os.path.dirname(reportlab.__file__), 'fonts', 'Vera.ttf')
+# accented letters are composite glyphs, which subsetting has to read the
+# components of as well
+_TEXTS = ('ÀÉÎÕÜ àéîõü', 'ÂÊÔÛ âêôû Ññ', 'ÄËÏÖ äëïöÿ Çç', 'Hello, world')
+
+def _paint(text):
+    output = BytesIO()
+    painter = pdfpainter.PDFPainter(output, 200, 100)
+    painter.set_font(_FONT_PATH)
+    painter.draw_string(10, 50, text)
+    painter.end_this_page()
+    painter.save()
+    return output.getvalue()
+
+class PDFPainterTest(unittest.TestCase):
+    def setUp(self):
+        # switch threads often, so that unserialized saves would interleave
+        self.__switch_interval = sys.getswitchinterval()
+        sys.setswitchinterval(1e-6)
+
+    def tearDown(self):
+        sys.setswitchinterval(self.__switch_interval)
+
+    def test_concurrent_saves(self):
+        expected = [_paint(text) for text in _TEXTS]
+        with ThreadPoolExecutor(8) as executor:
+            outputs = list(executor.map(_paint, _TEXTS * 16))
+        self.assertEqual(outputs, expected * 16)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -15,12 +15,16 @@ def main():
         return
     output_filename = args.outputFileName
 
-    core.generate_text_and_letter(senders, senders_addr,
-                                  receivers, receivers_addr,
-                                  ccs, cc_addr,
-                                  text)
-    core.merge_text_and_letter(output_filename)
-    core.clean_temp_files()
+    try:
+        letter = core.generate_letter(senders, senders_addr,
+                                      receivers, receivers_addr,
+                                      ccs, cc_addr,
+                                      text, font_mode=args.fontMode)
+    except core.MissingGlyphError as e:
+        print(u'字型缺少下列字元，請修改內容或設定 FALLBACK_FONT_PATHS: ', e)
+        return
+    with open(output_filename, 'wb') as output_file:
+        output_file.write(letter)
 
     print('Done. Filename: ', output_filename)
 
@@ -65,6 +69,12 @@ def process_args():
                             action='store',
                             metavar=u'輸出之檔案名稱',
                             default='output.pdf')
+    arg_parser.add_argument('--fontMode',
+                            action='store',
+                            choices=core.FONT_MODES,
+                            default=core.FONT_MODE_EMBEDDED,
+                            help=u'embedded: 內嵌字型 (預設，適合列印)；'
+                                 u'standard: 使用不內嵌的標準字型 MSung-Light，檔案較小，適合線上預覽')
     return arg_parser.parse_args()
 
 ##############################